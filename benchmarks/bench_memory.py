@@ -0,0 +1,88 @@
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from document_container import load_legacy_pages, open_pages, save_pages  # noqa: E402
+from synthetic import generate_document  # noqa: E402
+
+# Each measurement runs in a fresh process, so its peak RSS is its own.
+MODES = {
+    'legacy load (read + json.loads)': 'legacy-whole',
+    'legacy load (streaming)': 'legacy-stream',
+    'legacy -> container save': 'convert',
+    'container open + read all pages': 'container-read',
+}
+
+
+def peak_rss_mb():
+    # On Linux ru_maxrss survives exec, so a child would report the parent's peak.
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(mode, legacy_name, container_name):
+    baseline = peak_rss_mb()
+    if mode == 'legacy-whole':
+        with gzip.open(legacy_name, 'rb') as file:
+            pages = json.loads(file.read())["pages"]
+    elif mode == 'legacy-stream':
+        pages = load_legacy_pages(legacy_name)
+    elif mode == 'convert':
+        pages = open_pages(legacy_name)
+        save_pages(pages, container_name + '.copy').close()
+    else:
+        pages = open_pages(container_name)
+        for content in pages:
+            pass
+        pages.close()
+    print(f"{peak_rss_mb() - baseline:.1f}")
+
+
+def measure(mode, legacy_name, container_name):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', mode, legacy_name, container_name],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of loading and saving documents by page count.")
+    parser.add_argument('--pages', type=int, nargs='+', default=[250, 1000, 4000])
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'LEGACY', 'CONTAINER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'pages':>6} {'text MB':>8}  " + ' '.join(f"{name:>34}" for name in MODES))
+    with tempfile.TemporaryDirectory() as directory:
+        for page_count in args.pages:
+            legacy_name = os.path.join(directory, f'{page_count}.json.gz')
+            container_name = os.path.join(directory, f'{page_count}.txpd')
+            pages = generate_document(page_count)
+            text_mb = sum(len(page) for page in pages) / 1024 / 1024
+            with gzip.open(legacy_name, 'wt', encoding='utf-8') as file:
+                json.dump({"pages": pages}, file)
+            del pages
+            save_pages(open_pages(legacy_name), container_name).close()
+
+            peaks = [measure(mode, legacy_name, container_name) for mode in MODES.values()]
+            print(f"{page_count:>6} {text_mb:8.1f}  " + ' '.join(f"{peak:31.1f} MB" for peak in peaks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from PySide6.QtGui import QColor, QFont  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from bench_transforms import signature  # noqa: E402
+from commands import ApplyStyleDocumentCommand  # noqa: E402
+from custom_styles import StyleManager  # noqa: E402
+
+RUN_TAGS = ['', 'b', 'i', 'u']
+
+
+def styled_paragraph(runs):
+    # One long span with formatting tags around every other run, the shape
+    # that made the old per-run span search quadratic.
+    parts = []
+    for index in range(runs):
+        tag = RUN_TAGS[index % len(RUN_TAGS)]
+        word = f'word{index} '
+        parts.append(f'<{tag}>{word}</{tag}>' if tag else word)
+    return (
+        '<html><body><p style="margin:0px;"><span style=" font-size:12pt;">'
+        + ''.join(parts) + '</span></p></body></html>'
+    )
+
+
+def quadratic_apply(command, content):
+    # ApplyStyleDocumentCommand.apply_to_soup before it was made linear.
+    soup = BeautifulSoup(content, 'html.parser')
+    for text in soup.find_all(string=True):
+        parent_span = text.find_parent('span')
+        if parent_span is None:
+            parent_span = soup.new_tag('span')
+            text.wrap(parent_span)
+        for name, enabled in (('b', command.bold), ('i', command.italic), ('u', command.underline)):
+            if not enabled:
+                for tag in parent_span.find_all(name):
+                    tag.unwrap()
+        parent_span['style'] = command.css
+        for name in command.inline_tags:
+            text.wrap(soup.new_tag(name))
+    return str(soup)
+
+
+def soup_apply(command, content):
+    soup = BeautifulSoup(content, 'html.parser')
+    command.apply_to_soup(soup)
+    return str(soup)
+
+
+def timed(function, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(content)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ApplyStyleDocumentCommand against paragraph size.")
+    parser.add_argument('--runs', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+    # Styles are written beside their file and renamed over it, so it must be a real path.
+    style_manager = StyleManager(os.path.join(tempfile.mkdtemp(), 'styles.json'))
+    font = QFont('Arial')
+    font.setBold(True)
+    style_manager.add_style('bench', font, QColor('#336699'), 14)
+    command = ApplyStyleDocumentCommand(None, 'bench', style_manager)
+
+    failed = False
+    print(f"{'runs':>6} {'old soup s':>11} {'soup s':>8} {'stream s':>9} {'stream us/run':>14}  result")
+    for runs in args.runs:
+        content = styled_paragraph(runs)
+        old_time, old_result = timed(lambda page: quadratic_apply(command, page), content, args.repeat)
+        soup_time, soup_result = timed(lambda page: soup_apply(command, page), content, args.repeat)
+        stream_time, stream_result = timed(command.apply_to_string, content, args.repeat)
+        same = signature(old_result) == signature(soup_result) == signature(stream_result)
+        failed = failed or not same
+        print(f"{runs:>6} {old_time:11.3f} {soup_time:8.3f} {stream_time:9.4f} {stream_time / runs * 1e6:14.2f}  "
+              f"{'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
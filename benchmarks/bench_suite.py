@@ -0,0 +1,303 @@
+import argparse
+import gzip
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import PySide6  # noqa: E402
+from PySide6.QtCore import QBuffer, QByteArray  # noqa: E402
+from PySide6.QtGui import QColor, QFont, QImage  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from bench_transforms import make_commands  # noqa: E402
+from commands import (  # noqa: E402
+    ApplyStyleDocumentCommand, DocumentCommand, DocumentPipeline, FindReplaceRegExpDocumentCommand,
+    FindReplaceStringDocumentCommand, SetFontSizeDocumentCommand, ToggleBoldDocumentCommand,
+    ToggleItalicDocumentCommand
+)
+from custom_styles import StyleManager  # noqa: E402
+from document_container import PageList, save_pages  # noqa: E402
+from editor_widget import EditorWidget  # noqa: E402
+from image_store import image_url  # noqa: E402
+from page_text import page_text_cache  # noqa: E402
+from plain_page import large_page_characters, plain_page_html  # noqa: E402
+from synthetic import generate_document  # noqa: E402
+
+# Times the operations users wait on, on a synthetic document, and writes the
+# medians as JSON. With --compare the results are checked against a stored
+# run and the suite fails if anything got slower than the threshold allows.
+#   python benchmarks/bench_suite.py --output baseline.json
+#   python benchmarks/bench_suite.py --compare baseline.json
+
+
+def png_bytes(index, size=256):
+    image = QImage(size, size, QImage.Format_RGB32)
+    image.fill(QColor.fromHsv(index * 37 % 360, 160, 220))
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QBuffer.WriteOnly)
+    image.save(buffer, 'PNG')
+    return bytes(data)
+
+
+def write_documents(directory, args):
+    # The same pages as a container with its images, and as a legacy file.
+    pages = generate_document(
+        args.pages, paragraphs=args.paragraphs, words=args.words,
+        formatting_density=args.density, images=args.images
+    )
+    page_list = PageList()
+    sources = {f'image-{index}.png': image_url(page_list.add_image(png_bytes(index))) for index in range(args.images)}
+    for content in pages:
+        for source, url in sources.items():
+            content = content.replace(f'src="{source}"', f'src="{url}"')
+        page_list.append(content)
+
+    container_name = os.path.join(directory, 'document.txpd')
+    save_pages(page_list, container_name).close()
+    legacy_name = os.path.join(directory, 'legacy.json.gz')
+    with gzip.open(legacy_name, 'wt', encoding='utf-8') as file:
+        json.dump({"pages": pages}, file)
+    return container_name, legacy_name
+
+
+def clear_page_caches():
+    page_text_cache.pages.clear()
+
+
+def warm_page_caches(pages, versions):
+    # The state a search or an earlier find and replace leaves the pages in.
+    for content, version in zip(pages, versions):
+        page_text_cache.get(version, content)
+
+
+def make_document_commands(style_manager):
+    font = QFont('Arial')
+    font.setBold(True)
+    style_manager.add_style('bench', font, QColor('#336699'), 14)
+    commands = make_commands() + [
+        ApplyStyleDocumentCommand(None, 'bench', style_manager),
+        FindReplaceStringDocumentCommand(None, 'dolor', 'pain'),
+        FindReplaceRegExpDocumentCommand(None, r'(\w+)um\b', r'\1a'),
+        DocumentPipeline(None, [
+            ToggleBoldDocumentCommand(None), ToggleItalicDocumentCommand(None), SetFontSizeDocumentCommand(None, 14)
+        ]),
+    ]
+    for command in commands:
+        command.prepare()
+    return commands
+
+
+def leaf_subclasses(cls):
+    subclasses = cls.__subclasses__()
+    if not subclasses:
+        return {cls}
+    return set().union(*(leaf_subclasses(subclass) for subclass in subclasses))
+
+
+class Suite:
+    def __init__(self, app, repeat):
+        self.app = app
+        self.repeat = repeat
+        self.results = {}
+
+    def record(self, name, samples):
+        self.results[name] = {
+            "median_s": statistics.median(samples), "min_s": min(samples), "samples": len(samples)
+        }
+        print(f"{name:48} {statistics.median(samples) * 1000:10.2f} ms  (min {min(samples) * 1000:.2f} ms)")
+
+    def time(self, name, function, setup=None):
+        samples = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            self.app.processEvents()
+            start = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - start)
+        self.record(name, samples)
+
+    def run_files(self, editor_widget, container_name, legacy_name, directory):
+        self.time("load_file container", lambda: editor_widget.load_file(container_name))
+        self.time("load_file legacy", lambda: editor_widget.load_file(legacy_name))
+
+        editor_widget.load_file(container_name)
+        copy_name = os.path.join(directory, 'copy.txpd')
+
+        def edit_page():
+            page_num = editor_widget.current_page
+            editor_widget.file_manager.set_page_content(
+                page_num, editor_widget.file_manager.get_page_content(page_num) + '<p>edit</p>'
+            )
+
+        def save(file_name):
+            editor_widget.save_file(file_name)
+            editor_widget.wait_for_save()
+
+        self.time("save_file one page edited", lambda: save(container_name), setup=edit_page)
+        self.time("save_file to new file", lambda: save(copy_name), setup=lambda: editor_widget.load_file(container_name))
+
+    def run_page_flips(self, editor_widget, container_name):
+        # Each flip includes painting the new page; prefetching runs in between,
+        # as it would while the user reads.
+        editor_widget.load_file(container_name)
+        pages = editor_widget.file_manager.num_pages
+        flips = min(pages - 1, 50)
+        for name, flip in (("next_page", editor_widget.next_page), ("previous_page", editor_widget.previous_page)):
+            samples = []
+            for _ in range(flips):
+                self.app.processEvents()
+                start = time.perf_counter()
+                flip()
+                editor_widget.page_edit().viewport().repaint()
+                samples.append(time.perf_counter() - start)
+            self.record(name, samples)
+
+    def run_large_page(self, editor_widget):
+        # A pasted log one and a half times the large page threshold, opened
+        # from the file and then flipped back to from the page cache.
+        editor_widget.new_file()
+        file_manager = editor_widget.file_manager
+        lines = []
+        characters = 0
+        while characters < large_page_characters() * 3 // 2:
+            lines.append(f"{len(lines)} INFO worker <{len(lines) % 16}> finished job & wrote its output\n")
+            characters += len(lines[-1])
+        file_manager.new_page()
+        file_manager.set_page_content(1, plain_page_html(''.join(lines)))
+
+        def show(page_num):
+            editor_widget.set_current_page(page_num)
+            editor_widget.page_edit().viewport().repaint()
+
+        def reopen():
+            show(0)
+            editor_widget.reload_pages()
+            # Otherwise the page would be prefetched before it is timed.
+            editor_widget.prefetch_timer.stop()
+
+        self.time("open large page", lambda: show(1), setup=reopen)
+        self.time("flip back to large page", lambda: show(1), setup=lambda: show(0))
+
+    def run_commands(self, editor_widget, container_name, directory):
+        editor_widget.load_file(container_name)
+        file_manager = editor_widget.file_manager
+        pages = list(file_manager.data["pages"])
+        versions = list(file_manager.data["pages"].versions)
+        style_manager = StyleManager(os.path.join(directory, 'styles.json'))
+        commands = make_document_commands(style_manager)
+        missing = leaf_subclasses(DocumentCommand) - {type(command) for command in commands}
+        for cls in sorted(missing, key=lambda cls: cls.__name__):
+            print(f"not benchmarked: {cls.__name__}", file=sys.stderr)
+        # Runs leave page text cached by version, and no run commits, so cold
+        # runs start without it and warm runs with it for every page.
+        for command in commands:
+            self.time(
+                f"command {type(command).__name__} cold",
+                lambda: command.transform_pages(pages, versions=versions), setup=clear_page_caches
+            )
+        warm_page_caches(pages, versions)
+        for command in commands:
+            self.time(
+                f"command {type(command).__name__} warm",
+                lambda: command.transform_pages(pages, versions=versions)
+            )
+        style_manager.flush()
+
+    def run_startup(self, directory):
+        samples = []
+        report_name = os.path.join(directory, 'startup.json')
+        for _ in range(self.repeat):
+            subprocess.run(
+                [sys.executable, os.path.join(SRC_DIR, 'main.py'), f'--startup-report={report_name}'],
+                check=True, capture_output=True
+            )
+            with open(report_name) as file:
+                samples.append(json.load(file)["phases"][-1]["total_ms"] / 1000)
+        self.record("startup to editor first paint", samples)
+
+
+def compare(results, baseline, threshold):
+    # Returns the names that got slower than the threshold allows.
+    regressions = []
+    print(f"\n{'benchmark':48} {'baseline ms':>12} {'now ms':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:48} {'-':>12} {result['median_s'] * 1000:10.2f}      new")
+            continue
+        before, now = baseline[name]["median_s"], result["median_s"]
+        change = now / before - 1 if before else 0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:48} {before * 1000:12.2f} {now * 1000:10.2f} {change:+7.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time loading, saving, page flips and document commands.")
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--paragraphs', type=int, default=20, help="paragraphs per page")
+    parser.add_argument('--words', type=int, default=80, help="words per paragraph")
+    parser.add_argument('--density', type=float, default=0.3, help="share of text runs with formatting")
+    parser.add_argument('--images', type=int, default=2, help="images per page, shared by all pages")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['files', 'pages', 'commands', 'startup'])
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON file of an earlier run to check against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    suite = Suite(app, args.repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        container_name, legacy_name = write_documents(directory, args)
+        editor_widget = EditorWidget()
+        editor_widget.resize(800, 1000)
+        editor_widget.show()
+        if 'files' not in args.skip:
+            suite.run_files(editor_widget, container_name, legacy_name, directory)
+        if 'pages' not in args.skip:
+            suite.run_page_flips(editor_widget, container_name)
+            suite.run_large_page(editor_widget)
+        if 'commands' not in args.skip:
+            suite.run_commands(editor_widget, container_name, directory)
+        editor_widget.wait_for_save()
+        editor_widget.file_manager.close()
+        if 'startup' not in args.skip:
+            suite.run_startup(directory)
+
+    report = {
+        "parameters": {name: getattr(args, name) for name in ('pages', 'paragraphs', 'words', 'density', 'images', 'repeat')},
+        "environment": {
+            "python": platform.python_version(), "pyside6": PySide6.__version__, "platform": platform.platform()
+        },
+        "results": suite.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("parameters") != report["parameters"]:
+            print("warning: the baseline was run with other parameters", file=sys.stderr)
+        regressions = compare(suite.results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import sys
+import time
+from html.parser import HTMLParser
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from PySide6.QtGui import QColor, QFont  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from commands import (  # noqa: E402
+    DecreaseIndentDocumentCommand, IncreaseIndentDocumentCommand, SetFontColorDocumentCommand,
+    SetFontDocumentCommand, SetFontSizeDocumentCommand, SetLineSpacingDocumentCommand, ToggleBoldDocumentCommand,
+    ToggleItalicDocumentCommand, ToggleUnderlineDocumentCommand
+)
+from synthetic import generate_document  # noqa: E402
+
+
+class RenderSignature(HTMLParser):
+    # Text runs of the body with the tags and styles that apply to them, which
+    # is what the editor renders regardless of how the markup is spelled.
+    VOID = {'br', 'img', 'meta', 'hr', 'link', 'input'}
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.runs = []
+        self.styles = []
+
+    def handle_starttag(self, tag, attrs):
+        style = ' '.join(dict(attrs).get('style', '').split())
+        self.styles.append((tag, style))
+        if tag not in self.VOID:
+            self.stack.append((tag, style))
+
+    def handle_endtag(self, tag):
+        while self.stack:
+            if self.stack.pop()[0] == tag:
+                break
+
+    def handle_data(self, data):
+        if any(tag in ('head', 'style') for tag, _ in self.stack) or not data.strip():
+            return
+        self.runs.append((data, tuple(self.stack)))
+
+
+def signature(content):
+    parser = RenderSignature()
+    parser.feed(content)
+    parser.close()
+    return parser.runs, parser.styles
+
+
+def soup_transform(command, content):
+    soup = BeautifulSoup(content, 'html.parser')
+    command.apply_to_soup(soup)
+    return str(soup)
+
+
+def make_commands():
+    return [
+        ToggleBoldDocumentCommand(None),
+        ToggleItalicDocumentCommand(None),
+        ToggleUnderlineDocumentCommand(None),
+        SetFontDocumentCommand(None, QFont('Arial')),
+        SetFontSizeDocumentCommand(None, 14),
+        SetFontColorDocumentCommand(None, QColor('#336699')),
+        IncreaseIndentDocumentCommand(None),
+        DecreaseIndentDocumentCommand(None),
+        SetLineSpacingDocumentCommand(None, 1.5),
+    ]
+
+
+def timed(function, pages):
+    start = time.perf_counter()
+    results = [function(page) for page in pages]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the streaming engine with the BeautifulSoup path.")
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--paragraphs', type=int, default=20)
+    parser.add_argument('--density', type=float, default=0.3)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+    pages = generate_document(args.pages, paragraphs=args.paragraphs, formatting_density=args.density)
+
+    failed = False
+    print(f"{'command':38} {'soup s':>8} {'stream s':>9} {'speedup':>8}  result")
+    for command in make_commands():
+        soup_time, soup_pages = timed(lambda page: soup_transform(command, page), pages)
+        stream_time, stream_pages = timed(command.apply_to_string, pages)
+        same = all(signature(a) == signature(b) for a, b in zip(soup_pages, stream_pages))
+        failed = failed or not same
+        print(f"{type(command).__name__:38} {soup_time:8.3f} {stream_time:9.3f} "
+              f"{soup_time / stream_time:7.1f}x  {'ok' if same else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import random
+
+# Pages shaped like QTextEdit.toHtml() output, for benchmarks that must not
+# depend on real user documents.
+
+PAGE_HEAD = (
+    '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0//EN" "http://www.w3.org/TR/REC-html40/strict.dtd">\n'
+    '<html><head><meta name="qrichtext" content="1" /><meta charset="utf-8" /><style type="text/css">\n'
+    'p, li { white-space: pre-wrap; }\n'
+    'hr { height: 1px; border-width: 0; }\n'
+    'li.unchecked::marker { content: "\\2610"; }\n'
+    'li.checked::marker { content: "\\2612"; }\n'
+    '</style></head><body style=" font-family:\'Segoe UI\'; font-size:9pt; font-weight:400; font-style:normal;">\n'
+)
+PAGE_TAIL = '</body></html>'
+PARAGRAPH_STYLE = (
+    ' margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;'
+)
+RUN_STYLES = [
+    ' font-weight:700;',
+    ' font-style:italic;',
+    ' text-decoration: underline;',
+    ' font-family:\'Arial\'; font-size:14pt;',
+    ' color:#ff0000;',
+]
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi'
+).split()
+
+
+def generate_paragraph(rng, words, formatting_density, images):
+    runs = []
+    for _ in range(max(1, words // 8)):
+        text = ' '.join(rng.choice(WORDS) for _ in range(8)) + ' '
+        if rng.random() < formatting_density:
+            runs.append(f'<span style="{rng.choice(RUN_STYLES)}">{text}</span>')
+        else:
+            runs.append(text)
+    for index in range(images):
+        runs.append(f'<img src="image-{index}.png" width="64" height="64" />')
+    return f'<p style="{PARAGRAPH_STYLE}">{"".join(runs)}</p>'
+
+
+def generate_page(paragraphs=20, words=80, formatting_density=0.3, images=0, seed=0):
+    rng = random.Random(seed)
+    body = '\n'.join(
+        generate_paragraph(rng, words, formatting_density, images if index == 0 else 0)
+        for index in range(paragraphs)
+    )
+    return PAGE_HEAD + body + PAGE_TAIL
+
+
+def generate_document(pages=100, **page_options):
+    return [generate_page(seed=seed, **page_options) for seed in range(pages)]
@@ -0,0 +1,55 @@
+import os
+
+from PySide6.QtCore import QResource
+from PySide6.QtGui import QIcon, QPixmap
+
+# Files shipped with the application, found relative to this package rather
+# than the working directory. Icons are created once and shared. When
+# resources.rcc has been built (see README), they are read from that single
+# bundle instead of one file each.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCES_DIR = os.path.join(ROOT_DIR, 'resources')
+CONFIG_DIR = os.path.join(ROOT_DIR, 'config')
+RESOURCE_BUNDLE = os.path.join(ROOT_DIR, 'resources.rcc')
+BUNDLE_PREFIX = ':/resources'
+
+_icons = {}
+_pixmaps = {}
+_bundle_registered = None
+
+
+def config_path(name):
+    return os.path.join(CONFIG_DIR, name)
+
+
+def uses_bundle():
+    global _bundle_registered
+    if _bundle_registered is None:
+        _bundle_registered = os.path.exists(RESOURCE_BUNDLE) and QResource.registerResource(RESOURCE_BUNDLE)
+    return _bundle_registered
+
+
+def resource_path(name):
+    if uses_bundle():
+        return f'{BUNDLE_PREFIX}/{name}'
+    return os.path.join(RESOURCES_DIR, name)
+
+
+def resource_url(name):
+    # For style sheets, which want forward slashes on every platform.
+    return resource_path(name).replace(os.sep, '/')
+
+
+def icon(name):
+    cached = _icons.get(name)
+    if cached is None:
+        cached = _icons[name] = QIcon(resource_path(name))
+    return cached
+
+
+def pixmap(name):
+    cached = _pixmaps.get(name)
+    if cached is None:
+        cached = _pixmaps[name] = QPixmap(resource_path(name))
+    return cached
@@ -0,0 +1,222 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Nothing here opens a window, but Qt must not look for a display either.
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtGui import QColor, QFont  # noqa: E402
+
+from commands import (  # noqa: E402
+    ApplyStyleDocumentCommand,
+    DecreaseIndentDocumentCommand,
+    DocumentPipeline,
+    FindReplaceRegExpDocumentCommand,
+    FindReplaceStringDocumentCommand,
+    IncreaseIndentDocumentCommand,
+    SetFontColorDocumentCommand,
+    SetFontDocumentCommand,
+    SetFontSizeDocumentCommand,
+    SetLineSpacingDocumentCommand,
+    ToggleBoldDocumentCommand,
+    ToggleItalicDocumentCommand,
+    ToggleUnderlineDocumentCommand,
+)
+from custom_styles import StyleManager  # noqa: E402
+from document_container import EXTENSION  # noqa: E402
+from file_manager import FileManager  # noqa: E402
+from page_executor import worker_count  # noqa: E402
+
+# Applies document commands to many files without the editor:
+#   python src/batch.py --bold --replace old new --line-spacing 1.5 "docs/*.txpd"
+# Operations run on every page in the order they are given. Files are spread
+# across worker processes and each file is processed in one of them.
+
+
+class AddOperation(argparse.Action):
+    # Every operation option appends to the same list, so their order on the
+    # command line is kept.
+    def __call__(self, parser, namespace, values, option_string=None):
+        operations = getattr(namespace, 'operations', None) or []
+        operations.append((self.dest, values))
+        namespace.operations = operations
+
+
+def build_command(operations, style_manager=None):
+    pipeline = DocumentPipeline(None)
+    for name, value in operations:
+        if name == 'bold':
+            pipeline.add(ToggleBoldDocumentCommand(None))
+        elif name == 'italic':
+            pipeline.add(ToggleItalicDocumentCommand(None))
+        elif name == 'underline':
+            pipeline.add(ToggleUnderlineDocumentCommand(None))
+        elif name == 'font':
+            pipeline.add(SetFontDocumentCommand(None, QFont(value)))
+        elif name == 'size':
+            pipeline.add(SetFontSizeDocumentCommand(None, value))
+        elif name == 'color':
+            color = QColor(value)
+            if not color.isValid():
+                raise ValueError(f"invalid color: {value}")
+            pipeline.add(SetFontColorDocumentCommand(None, color))
+        elif name == 'indent':
+            pipeline.add(IncreaseIndentDocumentCommand(None))
+        elif name == 'outdent':
+            pipeline.add(DecreaseIndentDocumentCommand(None))
+        elif name == 'line_spacing':
+            pipeline.add(SetLineSpacingDocumentCommand(None, value))
+        elif name == 'style':
+            style_manager = style_manager or StyleManager()
+            if style_manager.compiled_style(value) is None:
+                raise ValueError(f"unknown style: {value}")
+            pipeline.add(ApplyStyleDocumentCommand(None, value, style_manager))
+        elif name == 'replace':
+            pipeline.add(FindReplaceStringDocumentCommand(None, *value))
+        elif name == 'replace_regexp':
+            # prepare reports a bad pattern in a message box; check it here first.
+            try:
+                re.compile(value[0]).sub(value[1], '')
+            except re.error as e:
+                raise ValueError(f"invalid regular expression: {e}") from None
+            pipeline.add(FindReplaceRegExpDocumentCommand(None, *value))
+    if not pipeline.prepare():
+        raise ValueError("nothing to find")
+    return pipeline
+
+
+def expand_files(patterns):
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def output_name(file_name, output_dir):
+    # Results are always written as containers, so a copy is named like one;
+    # the ".json.gz" of an old document goes as a whole.
+    if output_dir is None:
+        return file_name
+    name = os.path.basename(file_name)
+    name = os.path.splitext(name[:-len('.gz')] if name.endswith('.gz') else name)[0]
+    return os.path.join(output_dir, name + EXTENSION)
+
+
+def output_conflicts(files, output_dir):
+    # Inputs whose result would overwrite another input or another result.
+    inputs = {os.path.abspath(file_name) for file_name in files}
+    outputs = {}
+    conflicts = []
+    for file_name in files:
+        output = os.path.abspath(output_name(file_name, output_dir))
+        if output in outputs or (output in inputs and output != os.path.abspath(file_name)):
+            conflicts.append(f"{file_name} -> {output_name(file_name, output_dir)}")
+        outputs.setdefault(output, file_name)
+    return conflicts
+
+
+def process_file(file_name, command, output_file_name):
+    # Runs in a worker process. Pages are transformed one after another: the
+    # parallelism is across files.
+    started = time.perf_counter()
+    file_manager = FileManager()
+    try:
+        file_manager.open_file(file_name)
+        pages = file_manager.data["pages"]
+        changed_pages = {}
+        for page_num, content in enumerate(pages):
+            updated_content = command.apply_to_string(content)
+            if updated_content != content:
+                changed_pages[page_num] = updated_content
+        file_manager.replace_pages(changed_pages)
+        if changed_pages or output_file_name != file_name:
+            file_manager.save_file(output_file_name)
+        return file_manager.num_pages, len(changed_pages), time.perf_counter() - started, None
+    except Exception as e:
+        # One bad file is reported with the others instead of stopping the batch.
+        return 0, 0, time.perf_counter() - started, str(e) or type(e).__name__
+    finally:
+        file_manager.close()
+
+
+def run(files, command, output_dir, jobs):
+    # Returns the number of files that failed.
+    started = time.perf_counter()
+    failed = 0
+    total_pages = total_changed = 0
+    busy = 0.0
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+        futures = {
+            executor.submit(process_file, file_name, command, output_name(file_name, output_dir)): file_name
+            for file_name in files
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                pages, changed, seconds, error = future.result()
+            except Exception as e:
+                # The worker process itself failed, e.g. it was killed.
+                pages, changed, seconds, error = 0, 0, 0.0, str(e) or type(e).__name__
+            busy += seconds
+            if error:
+                failed += 1
+                print(f"{seconds:8.3f}s  FAILED  {file_name}: {error}")
+                continue
+            total_pages += pages
+            total_changed += changed
+            print(f"{seconds:8.3f}s  {changed:>6}/{pages:<6} pages changed  {file_name}")
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(files) - failed} of {len(files)} files, {total_changed}/{total_pages} pages changed "
+        f"in {elapsed:.3f}s ({busy:.3f}s in workers, {jobs} processes)"
+    )
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply document commands to many files.")
+    parser.add_argument('files', nargs='+', help="document files or glob patterns")
+    parser.add_argument(
+        '-o', '--output-dir', help="write results here, as .txpd containers, instead of over the input files"
+    )
+    parser.add_argument('-j', '--jobs', type=int, default=worker_count(), help="worker processes")
+    operations = parser.add_argument_group("operations, applied in the order given")
+    operations.add_argument('--bold', action=AddOperation, nargs=0)
+    operations.add_argument('--italic', action=AddOperation, nargs=0)
+    operations.add_argument('--underline', action=AddOperation, nargs=0)
+    operations.add_argument('--font', action=AddOperation, metavar='FAMILY')
+    operations.add_argument('--size', action=AddOperation, type=int)
+    operations.add_argument('--color', action=AddOperation)
+    operations.add_argument('--indent', action=AddOperation, nargs=0)
+    operations.add_argument('--outdent', action=AddOperation, nargs=0)
+    operations.add_argument('--line-spacing', action=AddOperation, type=float, metavar='FACTOR')
+    operations.add_argument('--style', action=AddOperation, metavar='NAME')
+    operations.add_argument('--replace', action=AddOperation, nargs=2, metavar=('FIND', 'REPLACE'))
+    operations.add_argument('--replace-regexp', action=AddOperation, nargs=2, metavar=('PATTERN', 'REPLACE'))
+    args = parser.parse_args(argv)
+
+    if not getattr(args, 'operations', None):
+        parser.error("no operations given")
+    try:
+        command = build_command(args.operations)
+    except ValueError as e:
+        parser.error(str(e))
+    files = expand_files(args.files)
+    if not files:
+        parser.error("no files matched")
+    conflicts = output_conflicts(files, args.output_dir)
+    if conflicts:
+        parser.error("several files would be written to the same place:\n  " + "\n  ".join(conflicts))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    return 1 if run(files, command, args.output_dir, max(1, args.jobs)) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,30 @@
 import re
 from abc import ABC, abstractmethod
+from functools import cached_property
 
-from PySide6 import QtGui, QtCore
-from PySide6.QtGui import QFont, QImage, QTextImageFormat, QTextCursor, QTextCharFormat, QColor
+from PySide6 import QtGui
+from PySide6.QtGui import QFont, QImageReader, QTextImageFormat, QTextCursor, QColor
 from PySide6.QtWidgets import QFileDialog, QInputDialog, QMessageBox
-from bs4 import BeautifulSoup
 
+from css_declarations import BLOCK_ELEMENTS, get_property, px_value, set_property
 from custom_styles import StyleManager
+from document_worker import run_document_command
 from editor_widget import EditorWidget
+from html_stream import RAW_TEXT_ELEMENTS, SpanStyleTransformer, StreamTransformer, UnsupportedMarkup
+from image_store import image_url
+from page_cache import PageDocument
+from page_executor import map_pages
+from page_text import extract_text, page_text_cache, replace_matches
+from tracing import traced_command, tracer
 
 
 class Command(ABC):
+    def __init_subclass__(cls, **kwargs):
+        # Every execute is timed, and profiled if asked to, while tracing is on.
+        super().__init_subclass__(**kwargs)
+        if 'execute' in cls.__dict__:
+            cls.execute = traced_command(cls.execute)
+
     @abstractmethod
     def execute(self):
         pass
@@ -52,6 +66,8 @@ class SetFontCommand(Command):
         self.font = font
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         cursor = self.editor_widget.text_edit.textCursor()
         current_format = cursor.charFormat()
         current_size = current_format.fontPointSize()
@@ -65,6 +81,8 @@ class SetFontSizeCommand(Command):
         self.size = size
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         self.editor_widget.text_edit.setFontPointSize(self.size)
 
 
@@ -74,6 +92,8 @@ class SetFontColorCommand(Command):
         self.color = color
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         self.editor_widget.text_edit.setTextColor(self.color)
 
 
@@ -83,6 +103,8 @@ class SetLineSpacingCommand(Command):
         self.spacing = spacing
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         cursor = self.editor_widget.text_edit.textCursor()
         block_fmt = QtGui.QTextBlockFormat()
         block_fmt.setLineHeight(float(self.spacing * 100), 1)
@@ -94,6 +116,8 @@ class ToggleBoldCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         text_edit = self.editor_widget.text_edit
         cursor = text_edit.textCursor()
 
@@ -115,6 +139,8 @@ class ToggleItalicCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         text_edit = self.editor_widget.text_edit
         cursor = text_edit.textCursor()
 
@@ -134,6 +160,8 @@ class ToggleUnderlineCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         text_edit = self.editor_widget.text_edit
         cursor = text_edit.textCursor()
 
@@ -153,6 +181,8 @@ class InsertImageCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self) -> None:
+        if self.editor_widget.refuse_rich_edit():
+            return
         file_dialog = QFileDialog()
         file_path, _ = file_dialog.getOpenFileName(None, "Insert Image", "",
                                                    "Images (*.png *.xpm *.jpg *.jpeg *.bmp *.gif)")
@@ -160,34 +190,39 @@ class InsertImageCommand(Command):
         if not file_path:
             return
 
-        image = QImage(file_path)
-        if image.isNull():
+        # Only the header is read here; the image is decoded off the GUI thread when shown.
+        image_size = QImageReader(file_path).size()
+        if not image_size.isValid():
             return
 
         width, ok_width = QInputDialog.getInt(
-            self.editor_widget, "Image Width", "Enter width:", image.width(), 1, 3000
+            self.editor_widget, "Image Width", "Enter width:", image_size.width(), 1, 3000
         )
         height, ok_height = QInputDialog.getInt(
-            self.editor_widget, "Image Height", "Enter height:", image.height(), 1, 3000
+            self.editor_widget, "Image Height", "Enter height:", image_size.height(), 1, 3000
         )
 
         if not ok_width or not ok_height:
             QMessageBox.critical(self.editor_widget, "Error", "Invalid width or height")
             return
 
-        image = image.scaled(width, height, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        try:
+            with open(file_path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return
+
+        # The original file is stored in the document and drawn at the chosen size.
+        digest = self.editor_widget.file_manager.add_image(data)
         text_cursor = self.editor_widget.text_edit.textCursor()
         document = self.editor_widget.text_edit.document()
-
-        document.addResource(
-            QtGui.QTextDocument.ImageResource,
-            QtCore.QUrl(file_path), image
-        )
+        if isinstance(document, PageDocument):
+            document.set_image_size(image_url(digest), width, height)
 
         image_format = QTextImageFormat()
         image_format.setWidth(width)
         image_format.setHeight(height)
-        image_format.setName(file_path)
+        image_format.setName(image_url(digest))
 
         text_cursor.insertImage(image_format)
 
@@ -197,6 +232,8 @@ class InsertLinkCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self):
+        if self.editor_widget.refuse_rich_edit():
+            return
         text_edit = self.editor_widget.text_edit
         cursor = text_edit.textCursor()
 
@@ -226,14 +263,12 @@ class ApplyStyleCommand(Command):
         self.style_manager = style_manager
 
     def execute(self):
-        font, color, size = self.style_manager.get_style(self.style_name)
-        if font and color and size:
+        if self.editor_widget.refuse_rich_edit():
+            return
+        style = self.style_manager.compiled_style(self.style_name)
+        if style and style.size:
             cursor = self.editor_widget.text_edit.textCursor()
-            text_format = QTextCharFormat()
-            text_format.setFont(font)
-            text_format.setForeground(color)
-            text_format.setFontPointSize(size)
-            cursor.mergeCharFormat(text_format)
+            cursor.mergeCharFormat(style.char_format)
             self.editor_widget.text_edit.setTextCursor(cursor)
 
 
@@ -242,230 +277,383 @@ class DocumentCommand(Command):
         self.editor_widget = editor_widget
 
     def execute(self):
-        self.editor_widget.save_current_page_content()
-        for page_num in range(self.editor_widget.file_manager.num_pages):
-            page_content = self.editor_widget.file_manager.get_page_content(page_num)
-            updated_content = self.apply_to_string(page_content)
-            self.editor_widget.file_manager.data["pages"][page_num] = updated_content
-        self.editor_widget.update_current_page()
+        if not self.prepare():
+            return
+        run_document_command(self.editor_widget, self)
+
+    def prepare(self):
+        return True
+
+    def prepare_pages(self):
+        # Runs when the command starts, which may be after a queued wait.
+        self.editor_widget.save_pages_content()
+
+    def transform_pages(self, pages, progress=None, is_cancelled=None, versions=None):
+        # Returns the pages that changed, or None if the run was cancelled.
+        name = type(self).__name__
+        with tracer.span('transform_pages', 'document', True, command=name, pages=len(pages)) as span, \
+                tracer.profile(name + '.transform_pages'):
+            changed_pages = {}
+            results = self.iter_transformed(pages, versions)
+            try:
+                for page_num, updated_content in enumerate(results):
+                    if is_cancelled and is_cancelled():
+                        span.set(cancelled=True)
+                        return None
+                    if updated_content != pages[page_num]:
+                        changed_pages[page_num] = updated_content
+                    if progress:
+                        progress(page_num + 1)
+            finally:
+                results.close()
+            span.set(changed=len(changed_pages))
+            return changed_pages
+
+    def iter_transformed(self, pages, versions=None):
+        return map_pages(self.apply_to_string, pages)
+
+    def commit(self, changed_pages):
+        self.editor_widget.file_manager.replace_pages(changed_pages)
+        self.editor_widget.reload_pages(changed_pages)
+
+    def __getstate__(self):
+        # Commands are sent to worker processes without the widget they were created for
+        # and without caches that are cheaper to rebuild there.
+        state = self.__dict__.copy()
+        state['editor_widget'] = None
+        state.pop('transformer', None)
+        state.pop('stages', None)
+        return state
 
     @abstractmethod
     def apply_to_string(self, content: str) -> str:
         pass
 
 
-class ToggleBoldDocumentCommand(DocumentCommand):
+class MarkupDocumentCommand(DocumentCommand):
+    # Commands that only wrap text runs and rewrite style attributes run on the
+    # streaming engine; pages it does not accept fall back to BeautifulSoup.
+    streamable = True
+    rewrites_style = False
 
     def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            if text.parent.name != 'b':
-                text.wrap(soup.new_tag("b"))
-        return str(soup)
+        return apply_markup_commands(content, [self], self.transformer)
 
+    @cached_property
+    def transformer(self):
+        return StreamTransformer([self]) if self.streamable else None
 
-class ToggleItalicDocumentCommand(DocumentCommand):
+    def wrap_text(self, parent_name):
+        return None
 
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            if text.parent.name != 'i':
-                text.wrap(soup.new_tag("i"))
-        return str(soup)
+    def rewrite_style(self, name, style):
+        return style
 
+    def apply_to_soup(self, soup):
+        from bs4 import NavigableString
 
-class ToggleUnderlineDocumentCommand(DocumentCommand):
+        for text in soup.find_all(string=True):
+            if type(text) is not NavigableString or text.find_parent('head') is not None:
+                continue
+            wrapper = self.wrap_text(text.parent.name)
+            if wrapper is not None:
+                name, style = wrapper
+                text.wrap(soup.new_tag(name) if style is None else soup.new_tag(name, style=style))
 
-    def apply_to_string(self, content: str) -> str:
+        if self.rewrites_style:
+            for element in soup.find_all():
+                style = element.get('style')
+                new_style = self.rewrite_style(element.name, style)
+                if new_style != style:
+                    element['style'] = new_style
+
+
+def apply_markup_commands(content, commands, transformer=None):
+    if transformer is not None:
+        try:
+            with tracer.phase('stream'):
+                return transformer.transform(content)
+        except UnsupportedMarkup:
+            pass
+    # bs4 takes a noticeable share of startup, and most pages never need it.
+    from bs4 import BeautifulSoup
+
+    with tracer.phase('parse'):
         soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            if text.parent.name != 'u':
-                text.wrap(soup.new_tag("u"))
+    with tracer.phase('transform'):
+        for command in commands:
+            command.apply_to_soup(soup)
+    with tracer.phase('serialize'):
         return str(soup)
 
 
-class SetFontDocumentCommand(DocumentCommand):
-
-    def __init__(self, editor_widget, font: QFont):
+class DocumentPipeline(DocumentCommand):
+    # Runs several document commands per page, passing over the page once for
+    # every run of consecutive markup commands instead of once per command.
+    def __init__(self, editor_widget, commands=()):
         super().__init__(editor_widget)
-        self.font = font
+        self.commands = list(commands)
+
+    def add(self, command: DocumentCommand):
+        self.commands.append(command)
+        self.__dict__.pop('stages', None)
+
+    def prepare(self):
+        return all(command.prepare() for command in self.commands)
+
+    @cached_property
+    def stages(self):
+        # Consecutive streamable markup commands share one stage and one pass
+        # over the page. The others run alone, on their own transformer.
+        groups = []
+        for command in self.commands:
+            if not isinstance(command, MarkupDocumentCommand) or not command.streamable:
+                groups.append(command)
+            elif groups and isinstance(groups[-1], list):
+                groups[-1].append(command)
+            else:
+                groups.append([command])
+
+        return [
+            (group, StreamTransformer(group)) if isinstance(group, list) else (group, None)
+            for group in groups
+        ]
 
     def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            text.wrap(soup.new_tag("span", style=f"font-family: '{self.font.family()}';"))
-        return str(soup)
+        for stage, transformer in self.stages:
+            if isinstance(stage, list):
+                content = apply_markup_commands(content, stage, transformer)
+            else:
+                content = stage.apply_to_string(content)
+        return content
 
 
-class SetFontSizeDocumentCommand(DocumentCommand):
+class ToggleBoldDocumentCommand(MarkupDocumentCommand):
 
-    def __init__(self, editor_widget, size: int):
-        super().__init__(editor_widget)
-        self.size = size
+    def wrap_text(self, parent_name):
+        return ('b', None) if parent_name != 'b' else None
 
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            text.wrap(soup.new_tag("span", style=f"font-size: {self.size}px;"))
-        return str(soup)
 
+class ToggleItalicDocumentCommand(MarkupDocumentCommand):
 
-class SetFontColorDocumentCommand(DocumentCommand):
+    def wrap_text(self, parent_name):
+        return ('i', None) if parent_name != 'i' else None
 
-    def __init__(self, editor_widget, color: QColor):
+
+class ToggleUnderlineDocumentCommand(MarkupDocumentCommand):
+
+    def wrap_text(self, parent_name):
+        return ('u', None) if parent_name != 'u' else None
+
+
+class SetFontDocumentCommand(MarkupDocumentCommand):
+
+    def __init__(self, editor_widget, font: QFont):
         super().__init__(editor_widget)
-        self.color = color
+        self.font_family = font.family()
 
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        for text in soup.find_all(text=True):
-            text.wrap(soup.new_tag("span", style=f"color: {self.color.name()};"))
-        return str(soup)
+    def wrap_text(self, parent_name):
+        return 'span', f"font-family: '{self.font_family}';"
 
 
-class IncreaseIndentDocumentCommand(DocumentCommand):
+class SetFontSizeDocumentCommand(MarkupDocumentCommand):
 
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        indent_increment = 20
+    def __init__(self, editor_widget, size: int):
+        super().__init__(editor_widget)
+        self.size = size
 
-        for element in soup.find_all():
-            current_style = element.get('style', '')
-            current_indent = self.extract_indent(current_style)
-            new_indent = current_indent + indent_increment
+    def wrap_text(self, parent_name):
+        return 'span', f"font-size: {self.size}px;"
 
-            new_style = re.sub(r'margin-left:\s*\d+px;', f'margin-left: {new_indent}px;', current_style)
-            if 'margin-left' not in new_style:
-                new_style = f'margin-left: {new_indent}px; ' + new_style
-            element['style'] = new_style
 
-        return str(soup)
+class SetFontColorDocumentCommand(MarkupDocumentCommand):
 
-    @staticmethod
-    def extract_indent(style: str) -> int:
-        match = re.search(r'margin-left:\s*(\d+)px;', style)
-        if match:
-            return int(match.group(1))
-        return 0
+    def __init__(self, editor_widget, color: QColor):
+        super().__init__(editor_widget)
+        self.color_name = color.name()
 
+    def wrap_text(self, parent_name):
+        return 'span', f"color: {self.color_name};"
 
-class DecreaseIndentDocumentCommand(DocumentCommand):
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        indent_decrement = 40
 
-        for element in soup.find_all():
-            current_style = element.get('style', '')
-            current_indent = self.extract_indent(current_style)
-            new_indent = max(current_indent - indent_decrement, 0)
+class IncreaseIndentDocumentCommand(MarkupDocumentCommand):
+    rewrites_style = True
+    indent_increment = 20
 
-            if new_indent != current_indent:
-                new_style = re.sub(r'margin-left:\s*\d+px;', f'margin-left: {new_indent}px;', current_style)
-                if 'margin-left' not in new_style:
-                    new_style = f'margin-left: {new_indent}px; ' + new_style
-                element['style'] = new_style
+    def rewrite_style(self, name, style):
+        if name not in BLOCK_ELEMENTS:
+            return style
+        new_indent = px_value(get_property(style, 'margin-left')) + self.indent_increment
+        return set_property(style, 'margin-left', f'{new_indent}px')
 
-        return str(soup)
 
-    @staticmethod
-    def extract_indent(style: str) -> int:
-        match = re.search(r'margin-left:\s*(\d+)px;', style)
-        if match:
-            return int(match.group(1))
-        return 0
+class DecreaseIndentDocumentCommand(MarkupDocumentCommand):
+    rewrites_style = True
+    indent_decrement = 40
+
+    def rewrite_style(self, name, style):
+        if name not in BLOCK_ELEMENTS:
+            return style
+        current_indent = px_value(get_property(style, 'margin-left'))
+        new_indent = max(current_indent - self.indent_decrement, 0)
+        if new_indent == current_indent:
+            return style
+        return set_property(style, 'margin-left', f'{new_indent}px')
 
 
-class SetLineSpacingDocumentCommand(DocumentCommand):
+class SetLineSpacingDocumentCommand(MarkupDocumentCommand):
+    rewrites_style = True
 
     def __init__(self, editor_widget, spacing: float):
         super().__init__(editor_widget)
         self.spacing = spacing
+        # The editor reads and writes proportional line height as a percentage.
+        self.line_height = f'{round(spacing * 100)}%'
 
-    def apply_to_string(self, content: str) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        line_height_regex = re.compile(r'line-height:\s*[\d.]+(?:px|em|%)?;?')
-
-        for element in soup.find_all(['p', 'div', 'span']):
-            current_style = element.get('style', '')
-            new_style = line_height_regex.sub(f'line-height: {self.spacing};', current_style)
-            if new_style == current_style:
-                new_style = f'line-height: {self.spacing}; ' + current_style
+    def rewrite_style(self, name, style):
+        if name not in BLOCK_ELEMENTS:
+            return style
+        if get_property(style, 'line-height') == self.line_height:
+            return style
+        return set_property(style, 'line-height', self.line_height)
 
-            element['style'] = new_style.strip()
-
-        return str(soup)
 
-
-class ApplyStyleDocumentCommand(DocumentCommand):
+class ApplyStyleDocumentCommand(MarkupDocumentCommand):
+    # Restyles whole spans rather than wrapping runs, so it cannot share a
+    # StreamTransformer pass and runs on its own SpanStyleTransformer.
+    streamable = False
 
     def __init__(self, editor_widget, style_name, style_manager):
         super().__init__(editor_widget)
         self.style_name = style_name
-        self.style_manager = style_manager
-
-    def apply_to_string(self, content):
-        font, color, size = self.style_manager.get_style(self.style_name)
-
-        soup = BeautifulSoup(content, 'html.parser')
+        style = style_manager.compiled_style(style_name)
+        self.has_style = style is not None
+        if self.has_style:
+            self.bold = style.font.bold()
+            self.italic = style.font.italic()
+            self.underline = style.font.underline()
+            self.css = style.css
+            flags = (('b', self.bold), ('i', self.italic), ('u', self.underline))
+            self.inline_tags = [name for name, enabled in flags if enabled]
+            self.strip_tags = [name for name, enabled in flags if not enabled]
 
-        for text in soup.find_all(text=True):
-            parent_span = text.find_parent("span")
-            if parent_span is None:
-                parent_span = soup.new_tag("span")
-                text.wrap(parent_span)
-
-            if not font.bold():
-                for bold in parent_span.find_all("b"):
-                    bold.unwrap()
+    def apply_to_string(self, content: str) -> str:
+        if not self.has_style:
+            return content
+        return super().apply_to_string(content)
 
-            if not font.italic():
-                for italic in parent_span.find_all("i"):
-                    italic.unwrap()
+    @cached_property
+    def transformer(self):
+        return SpanStyleTransformer(self.css, self.inline_tags, self.strip_tags)
 
-            if not font.underline():
-                for underline in parent_span.find_all("u"):
-                    underline.unwrap()
+    def apply_to_soup(self, soup):
+        from bs4 import NavigableString, Tag
 
-            style = f"font-family: '{font.family()}'; font-size: {size}px; color: {color.name()};"
-            parent_span["style"] = style
+        if not self.has_style:
+            return
 
-            if font.bold():
-                text.wrap(soup.new_tag("b"))
+        # One walk collects the body text with its nearest span; every span is
+        # then restyled and stripped once, however many runs it holds.
+        runs = []
+        pending = [(soup, None)]
+        while pending:
+            element, span = pending.pop()
+            for child in element.contents:
+                if isinstance(child, Tag):
+                    if child.name != 'head' and child.name not in RAW_TEXT_ELEMENTS:
+                        pending.append((child, child if child.name == 'span' else span))
+                elif type(child) is NavigableString:
+                    runs.append((child, span))
+
+        spans = {}
+        for text, span in runs:
+            if span is None:
+                text.wrap(soup.new_tag('span', style=self.css))
+            else:
+                spans[id(span)] = span
+            for name in self.inline_tags:
+                text.wrap(soup.new_tag(name))
+
+        for span in spans.values():
+            span['style'] = self.css
+            if self.strip_tags:
+                for tag in span.find_all(self.strip_tags):
+                    tag.unwrap()
+
+
+class FindReplaceDocumentCommand(DocumentCommand):
+    # Searches the text the editor shows instead of the page HTML, so matches may
+    # span formatting and never touch tags or attributes.
 
-            if font.italic():
-                text.wrap(soup.new_tag("i"))
+    def apply_to_string(self, content):
+        with tracer.phase('extract'):
+            page_text = extract_text(content)
+        return self.replace_in_page(content, page_text)
+
+    def replace_in_page(self, content, page_text):
+        with tracer.phase('find'):
+            matches = list(self.find_matches(page_text.text))
+        if not matches:
+            return content
+        with tracer.phase('replace'):
+            return replace_matches(content, page_text, matches)
+
+    def iter_transformed(self, pages, versions=None):
+        # With extracted text cached per page version, most pages cost one search
+        # and sending them to worker processes would only add pickling.
+        if versions is None:
+            return super().iter_transformed(pages)
+        return (
+            self.replace_in_page(page, self.cached_page_text(page, version)) for page, version in zip(pages, versions)
+        )
 
-            if font.underline():
-                text.wrap(soup.new_tag("u"))
+    def cached_page_text(self, content, version):
+        with tracer.phase('extract'):
+            return page_text_cache.get(version, content)
 
-        return str(soup)
+    @abstractmethod
+    def find_matches(self, text):
+        pass
 
 
-class FindReplaceRegExpDocumentCommand(DocumentCommand):
+class FindReplaceRegExpDocumentCommand(FindReplaceDocumentCommand):
     def __init__(self, editor_widget, find_text, replace_text):
         super().__init__(editor_widget)
         self.findText = find_text
         self.replaceText = replace_text
 
-    def apply_to_string(self, content):
+    def prepare(self):
         try:
-            pattern = re.compile(self.findText)
-            return pattern.sub(self.replaceText, content)
+            self.pattern = re.compile(self.findText)
+            # Also catches bad group references in the replacement before any page is touched.
+            self.pattern.sub(self.replaceText, '')
         except re.error as e:
             QMessageBox.critical(
                 self.editor_widget,
                 "Ошибка",
                 f"Некорректное регулярное выражение: {e}"
             )
-            return content
+            return False
+        return True
+
+    def find_matches(self, text):
+        for match in self.pattern.finditer(text):
+            yield match.start(), match.end(), match.expand(self.replaceText)
 
 
-class FindReplaceStringDocumentCommand(DocumentCommand):
+class FindReplaceStringDocumentCommand(FindReplaceDocumentCommand):
     def __init__(self, editor_widget, find_text, replace_text, use_regexp=False):
         super().__init__(editor_widget)
         self.findText = find_text
         self.replaceText = replace_text
         self.useRegexp = use_regexp
 
-    def apply_to_string(self, content):
-        return content.replace(self.findText, self.replaceText)
+    def prepare(self):
+        return bool(self.findText)
+
+    def find_matches(self, text):
+        start = text.find(self.findText)
+        while start >= 0:
+            end = start + len(self.findText)
+            yield start, end, self.replaceText
+            start = text.find(self.findText, end)
@@ -0,0 +1,47 @@
+import re
+from functools import lru_cache
+
+# Inline style attributes as ordered (property, value) declarations, written
+# back in the form QTextEdit.toHtml uses (" name:value;"), so a page that goes
+# through the editor again keeps the same style strings. Style strings repeat
+# across elements and pages, so parsing and edits are cached per string.
+
+# Elements laid out as text blocks, the only ones margins and line height apply to.
+BLOCK_ELEMENTS = frozenset(['blockquote', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'p', 'pre'])
+
+DECLARATION_RE = re.compile(r'''([-\w]+)\s*:\s*((?:[^;"']|"[^"]*"|'[^']*')*)''')
+PX_RE = re.compile(r'(-?\d+(?:\.\d+)?)px$')
+
+
+@lru_cache(maxsize=4096)
+def parse_style(style):
+    # A property given twice keeps its first position and its last value.
+    declarations = {}
+    for match in DECLARATION_RE.finditer(style or ''):
+        value = match.group(2).strip()
+        if value:
+            declarations[match.group(1).lower()] = value
+    return tuple(declarations.items())
+
+
+def serialize_style(declarations):
+    return ''.join(f' {name}:{value};' for name, value in declarations)
+
+
+def get_property(style, name):
+    for declared_name, value in parse_style(style):
+        if declared_name == name:
+            return value
+    return None
+
+
+@lru_cache(maxsize=4096)
+def set_property(style, name, value):
+    declarations = dict(parse_style(style))
+    declarations[name] = value
+    return serialize_style(declarations.items())
+
+
+def px_value(value):
+    match = PX_RE.match(value or '')
+    return round(float(match.group(1))) if match else 0
@@ -1,29 +1,77 @@
 import json
 import os
 
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QFont, QColor, QIcon
+from PySide6.QtCore import QCoreApplication, Qt, QTimer
+from PySide6.QtGui import QFont, QColor, QTextCharFormat
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QComboBox, QPushButton, QLineEdit, QColorDialog, QLabel,
     QFontComboBox, QToolBar, QToolButton
 )
 
+from assets import config_path, icon
+
+
+# Edits made within this many milliseconds are written to the styles file together.
+SAVE_DELAY_MS = 500
+
+
+class CompiledStyle:
+    # A style in the forms commands use, built once instead of on every use.
+    # The objects are shared and must not be modified.
+    def __init__(self, style):
+        self.font = QFont()
+        self.font.fromString(style['font'])
+        self.font.setBold(style.get('bold', False))
+        self.font.setItalic(style.get('italic', False))
+        self.font.setUnderline(style.get('underline', False))
+        self.color = QColor(style['color'])
+        self.size = style['size']
+
+        self.char_format = QTextCharFormat()
+        self.char_format.setFont(self.font)
+        self.char_format.setForeground(self.color)
+        self.char_format.setFontPointSize(self.size)
+        self.css = f"font-family: '{self.font.family()}'; font-size: {self.size}px; color: {self.color.name()};"
+
 
 class StyleManager:
-    def __init__(self, filepath=os.path.join('..', 'config', 'styles.json')):
+    def __init__(self, filepath=config_path('styles.json')):
         self.filepath = filepath
         self.styles = self.load_styles()
+        self.compiled = {}
+        self.save_timer = None
 
     def load_styles(self):
         try:
             with open(self.filepath, 'r') as file:
                 return json.load(file)
         except (FileNotFoundError, json.JSONDecodeError):
-            self.styles = {}
+            return {}
 
     def save_styles(self):
-        with open(self.filepath, 'w') as file:
+        app = QCoreApplication.instance()
+        if app is None:
+            self.write_styles()
+            return
+        if self.save_timer is None:
+            self.save_timer = QTimer()
+            self.save_timer.setSingleShot(True)
+            self.save_timer.setInterval(SAVE_DELAY_MS)
+            self.save_timer.timeout.connect(self.write_styles)
+            app.aboutToQuit.connect(self.flush)
+        self.save_timer.start()
+
+    def flush(self):
+        if self.save_timer is not None and self.save_timer.isActive():
+            self.save_timer.stop()
+            self.write_styles()
+
+    def write_styles(self):
+        # Written beside the old file and renamed over it, so a crash never leaves half a file.
+        temp_path = self.filepath + '.tmp'
+        with open(temp_path, 'w') as file:
             json.dump(self.styles, file)
+        os.replace(temp_path, self.filepath)
 
     def add_style(self, name, font: QFont, color: QColor, size: int):
         self.styles[name] = {
@@ -34,24 +82,28 @@ class StyleManager:
             'italic': font.italic(),
             'underline': font.underline()
         }
+        self.compiled.pop(name, None)
         self.save_styles()
 
     def delete_style(self, name):
         if name in self.styles:
             del self.styles[name]
+            self.compiled.pop(name, None)
             self.save_styles()
 
+    def compiled_style(self, name):
+        compiled = self.compiled.get(name)
+        if compiled is None:
+            style = self.styles.get(name)
+            if not style:
+                return None
+            compiled = self.compiled[name] = CompiledStyle(style)
+        return compiled
+
     def get_style(self, name):
-        style = self.styles.get(name)
-        if style:
-            font = QFont()
-            font.fromString(style['font'])
-            color = QColor(style['color'])
-            size = style['size']
-            font.setBold(style.get('bold', False))
-            font.setItalic(style.get('italic', False))
-            font.setUnderline(style.get('underline', False))
-            return font, color, size
+        compiled = self.compiled_style(name)
+        if compiled is not None:
+            return compiled.font, compiled.color, compiled.size
         return None, None, None
 
 
@@ -74,7 +126,7 @@ class StyleDialog(QDialog):
 
         select_button = QToolButton()
         select_button.setText("select")
-        select_button.setIcon(QIcon('../resources/select.png'))
+        select_button.setIcon(icon('select.png'))
         select_button.setToolTip('Select style')
         select_button.clicked.connect(self.select_style)
         toolbar.addWidget(select_button)
@@ -83,21 +135,21 @@ class StyleDialog(QDialog):
 
         add_button = QToolButton()
         add_button.setText("add")
-        add_button.setIcon(QIcon('../resources/add.png'))
+        add_button.setIcon(icon('add.png'))
         add_button.setToolTip('Add style')
         add_button.clicked.connect(self.create_style)
         toolbar.addWidget(add_button)
 
         edit_button = QToolButton()
         edit_button.setText("edit")
-        edit_button.setIcon(QIcon('../resources/edit.png'))
+        edit_button.setIcon(icon('edit.png'))
         edit_button.setToolTip('Edit style')
         edit_button.clicked.connect(self.edit_style)
         toolbar.addWidget(edit_button)
 
         delete_button = QToolButton()
         delete_button.setText("delete")
-        delete_button.setIcon(QIcon('../resources/delete.png'))
+        delete_button.setIcon(icon('delete.png'))
         delete_button.setToolTip('Delete style')
         delete_button.clicked.connect(self.delete_style)
         toolbar.addWidget(delete_button)
@@ -0,0 +1,435 @@
+import copy
+import gzip
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+
+MAGIC = b'TXPD'
+VERSION = 2
+# Given to container files written under a new name.
+EXTENSION = '.txpd'
+
+# magic, version, flags, page count, offset of the page index
+HEADER = struct.Struct('<4sHHIQ')
+# Since version 2, directly after the header: image count, offset of the image index
+IMAGE_HEADER = struct.Struct('<IQ')
+DATA_OFFSET = HEADER.size + IMAGE_HEADER.size
+# offset and length of one compressed page frame
+INDEX_ENTRY = struct.Struct('<QI')
+# sha256 of the image file, offset and length of its bytes
+IMAGE_ENTRY = struct.Struct('<32sQI')
+
+# Pages refer to stored images by this prefix followed by the hex digest.
+IMAGE_URL_PREFIX = 'image:'
+IMAGE_REF_RE = re.compile(re.escape(IMAGE_URL_PREFIX) + '([0-9a-f]{64})')
+
+# Share of the file that may be taken by superseded frames and old indexes
+# before an incremental save rewrites the whole file instead.
+COMPACTION_RATIO = 0.5
+
+
+class ContainerFormatError(ValueError):
+    pass
+
+
+def is_container(file_name):
+    with open(file_name, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def compress_page(content):
+    return zlib.compress(content.encode('utf-8'))
+
+
+def decompress_page(frame):
+    return zlib.decompress(frame).decode('utf-8')
+
+
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class DocumentContainer:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ContainerFormatError("empty file")
+        try:
+            self.frames, self.images = self._read_index()
+        except ContainerFormatError:
+            self.close()
+            raise
+
+    def _read_index(self):
+        if len(self._map) < HEADER.size:
+            raise ContainerFormatError("truncated header")
+        magic, version, _, page_count, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ContainerFormatError("not a document container")
+        if version > VERSION:
+            raise ContainerFormatError(f"unsupported container version {version}")
+        self.version = version
+        if index_offset + page_count * INDEX_ENTRY.size > len(self._map):
+            raise ContainerFormatError("truncated page index")
+        frames = [
+            INDEX_ENTRY.unpack_from(self._map, index_offset + i * INDEX_ENTRY.size)
+            for i in range(page_count)
+        ]
+
+        images = {}
+        if version >= 2:
+            if len(self._map) < DATA_OFFSET:
+                raise ContainerFormatError("truncated header")
+            image_count, image_index_offset = IMAGE_HEADER.unpack_from(self._map, HEADER.size)
+            if image_index_offset + image_count * IMAGE_ENTRY.size > len(self._map):
+                raise ContainerFormatError("truncated image index")
+            for i in range(image_count):
+                digest, offset, length = IMAGE_ENTRY.unpack_from(self._map, image_index_offset + i * IMAGE_ENTRY.size)
+                images[digest.hex()] = (offset, length)
+        return frames, images
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    def raw_frame(self, frame):
+        offset, length = frame
+        return self._map[offset:offset + length]
+
+    def read_frame(self, frame):
+        try:
+            return decompress_page(self.raw_frame(frame))
+        except zlib.error as e:
+            raise ContainerFormatError(f"corrupt page frame: {e}")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# Page versions are unique across all page lists, so caches keyed by version
+# never confuse pages of different documents.
+_versions = itertools.count()
+
+
+class PageList:
+    # Pages are kept either as frame references into an open container, decoded
+    # on access, or as plain strings once they have been set. Images work the
+    # same way, keyed by digest: frame references or bytes not yet saved.
+    def __init__(self, pages=(), container=None):
+        self.container = container
+        self._entries = list(container.frames) if container else list(pages)
+        self.versions = [next(_versions) for _ in self._entries]
+        self.images = dict(container.images) if container else {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        entry = self._entries[index]
+        if isinstance(entry, str):
+            return entry
+        return self.container.read_frame(entry)
+
+    def __setitem__(self, index, content):
+        self._entries[index] = content
+        self.versions[index] = next(_versions)
+
+    def __iter__(self):
+        for index in range(len(self._entries)):
+            yield self[index]
+
+    def append(self, content):
+        self._entries.append(content)
+        self.versions.append(next(_versions))
+
+    def frames(self):
+        for entry in self._entries:
+            if isinstance(entry, str):
+                yield compress_page(entry)
+            else:
+                yield self.container.raw_frame(entry)
+
+    def snapshot(self):
+        # A copy sharing the container and the immutable page strings, cheap
+        # enough to take on the GUI thread and write out on another one.
+        snapshot = copy.copy(self)
+        snapshot._entries = list(self._entries)
+        snapshot.versions = list(self.versions)
+        snapshot.images = dict(self.images)
+        return snapshot
+
+    def add_image(self, data):
+        # Identical images are stored once, however many pages show them.
+        digest = image_digest(data)
+        self.images.setdefault(digest, data)
+        return digest
+
+    def image_data(self, digest):
+        entry = self.images.get(digest)
+        if entry is None or isinstance(entry, bytes):
+            return entry
+        return self.container.raw_frame(entry)
+
+    def image_blobs(self):
+        for digest in self.images:
+            yield digest, self.image_data(digest)
+
+    @property
+    def dirty_images(self):
+        return [digest for digest, entry in self.images.items() if isinstance(entry, bytes)]
+
+    def frame_ref(self, index):
+        return self._entries[index]
+
+    def is_dirty(self, index):
+        return isinstance(self._entries[index], str)
+
+    @property
+    def dirty_pages(self):
+        return [index for index, entry in enumerate(self._entries) if isinstance(entry, str)]
+
+    def stale_size(self):
+        live = DATA_OFFSET + sum(entry[1] for entry in self._entries if not isinstance(entry, str))
+        live += sum(entry[1] for entry in self.images.values() if not isinstance(entry, bytes))
+        return self.container.size - live
+
+    def close(self):
+        if self.container:
+            self.container.close()
+            self.container = None
+
+
+def _commit_index(file, index, image_index, index_offset):
+    for entry in index:
+        file.write(INDEX_ENTRY.pack(*entry))
+    for digest, offset, length in image_index:
+        file.write(IMAGE_ENTRY.pack(bytes.fromhex(digest), offset, length))
+    # Everything the new header points to must be on disk before the header
+    # itself is rewritten, so a crash leaves either the old or the new index.
+    file.flush()
+    os.fsync(file.fileno())
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, VERSION, 0, len(index), index_offset))
+    file.write(IMAGE_HEADER.pack(len(image_index), index_offset + len(index) * INDEX_ENTRY.size))
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def write_container(file, frames, images=()):
+    file.write(bytes(DATA_OFFSET))
+    offset = DATA_OFFSET
+    index = []
+    for frame in frames:
+        file.write(frame)
+        index.append((offset, len(frame)))
+        offset += len(frame)
+    image_index = []
+    for digest, data in images:
+        file.write(data)
+        image_index.append((digest, offset, len(data)))
+        offset += len(data)
+    _commit_index(file, index, image_index, offset)
+
+
+def append_dirty_pages(pages: PageList, file_name):
+    with open(file_name, 'r+b') as file:
+        offset = file.seek(0, os.SEEK_END)
+        index = []
+        for page_num in range(len(pages)):
+            if pages.is_dirty(page_num):
+                frame = compress_page(pages[page_num])
+                file.write(frame)
+                index.append((offset, len(frame)))
+                offset += len(frame)
+            else:
+                index.append(pages.frame_ref(page_num))
+        image_index = []
+        for digest, entry in pages.images.items():
+            if isinstance(entry, bytes):
+                file.write(entry)
+                entry = (offset, len(entry))
+                offset += entry[1]
+            image_index.append((digest, *entry))
+        _commit_index(file, index, image_index, offset)
+
+
+def referenced_images(pages: PageList):
+    digests = set()
+    for content in pages:
+        digests.update(IMAGE_REF_RE.findall(content))
+    return digests
+
+
+# Decompressed text read from a legacy file at a time.
+LEGACY_CHUNK_SIZE = 1 << 20
+
+
+class JsonStreamReader:
+    # Reads JSON values one at a time from a text stream, holding only the
+    # unparsed rest of the current chunk besides the value being decoded.
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.file.read(LEGACY_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def consume(self, char):
+        self.skip_whitespace()
+        if self.buffer.startswith(char, self.pos):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.consume(char):
+            raise ContainerFormatError(f"expected '{char}' in page data")
+
+    def value(self):
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def array(self):
+        self.expect('[')
+        if self.consume(']'):
+            return
+        while True:
+            yield self.value()
+            if self.consume(']'):
+                return
+            self.expect(',')
+
+
+def iter_legacy_pages(file):
+    # Yields the pages of {"pages": [...]} as they are decoded; other keys are skipped.
+    reader = JsonStreamReader(file)
+    found = False
+    reader.expect('{')
+    if not reader.consume('}'):
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == "pages" and not found:
+                found = True
+                for page in reader.array():
+                    if not isinstance(page, str):
+                        raise ContainerFormatError("page is not a string")
+                    yield page
+            else:
+                reader.value()
+            if reader.consume('}'):
+                break
+            reader.expect(',')
+    if not found:
+        raise ContainerFormatError("missing page list")
+
+
+def load_legacy_pages(file_name):
+    with gzip.open(file_name, 'rt', encoding='utf-8') as file:
+        return list(iter_legacy_pages(file))
+
+
+def open_pages(file_name):
+    if is_container(file_name):
+        return PageList(container=DocumentContainer(file_name))
+    return PageList(load_legacy_pages(file_name))
+
+
+def can_append(pages: PageList, file_name):
+    if pages.container is None:
+        return False
+    # Older containers have a shorter header; the current one would overwrite their first frame.
+    if pages.container.version != VERSION:
+        return False
+    if os.path.abspath(pages.container.file_name) != os.path.abspath(file_name):
+        return False
+    return pages.stale_size() <= COMPACTION_RATIO * pages.container.size
+
+
+def write_pages(pages: PageList, file_name, compact=False):
+    # Writes pages without closing the container they come from, so it can run
+    # on a snapshot while the editor keeps reading. Returns the temporary file
+    # finish_save has to move over file_name, or None if pages were appended.
+    if not compact and can_append(pages, file_name):
+        if pages.dirty_pages or pages.dirty_images:
+            append_dirty_pages(pages, file_name)
+        return None
+
+    images = pages.image_blobs()
+    if compact:
+        # Images no page refers to any more are only dropped when the whole file is rewritten.
+        used = referenced_images(pages)
+        images = ((digest, data) for digest, data in images if digest in used)
+    temp_name = file_name + '.tmp'
+    try:
+        with open(temp_name, 'wb') as file:
+            write_container(file, pages.frames(), images)
+    except OSError:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    return temp_name
+
+
+def finish_save(pages: PageList, saved: PageList, file_name, temp_name):
+    # Reopens the saved file for pages, where saved is what was written. Pages
+    # changed or added since then keep their unsaved content and stay dirty.
+    # The old file may still be mapped; release it before replacing it.
+    pages.close()
+    if temp_name is not None:
+        os.replace(temp_name, file_name)
+    reopened = open_pages(file_name)
+    for index in range(len(pages)):
+        if index >= len(saved):
+            reopened.append(pages._entries[index])
+        elif pages.versions[index] != saved.versions[index]:
+            reopened._entries[index] = pages._entries[index]
+    # Saving does not change any page, so the pages keep their versions.
+    reopened.versions = list(pages.versions)
+    for digest, entry in pages.images.items():
+        if digest not in reopened.images and isinstance(entry, bytes):
+            reopened.images[digest] = entry
+    return reopened
+
+
+def save_pages(pages: PageList, file_name, compact=False):
+    if not compact and can_append(pages, file_name) and not pages.dirty_pages and not pages.dirty_images:
+        return pages
+    temp_name = write_pages(pages, file_name, compact)
+    return finish_save(pages, pages, file_name, temp_name)
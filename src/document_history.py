@@ -0,0 +1,106 @@
+import hashlib
+import zlib
+
+from settings import settings
+
+COMPRESS_LEVEL = 6
+
+
+def content_digest(content):
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+class HistoryEntry:
+    # The pages one whole-document command changed, as (before, after)
+    # digests of their content. The compressed contents travel with the entry
+    # until it is pushed, so entries can be built off the GUI thread.
+    __slots__ = ('label', 'pages', 'blobs')
+
+    def __init__(self, label, before, after):
+        self.label = label
+        self.pages = {}
+        self.blobs = {}
+        for page_num, content in after.items():
+            self.pages[page_num] = (self.add_blob(before[page_num]), self.add_blob(content))
+
+    def add_blob(self, content):
+        digest = content_digest(content)
+        if digest not in self.blobs:
+            self.blobs[digest] = zlib.compress(content.encode('utf-8'), COMPRESS_LEVEL)
+        return digest
+
+    def digests(self):
+        return {digest for pair in self.pages.values() for digest in pair}
+
+
+class DocumentHistory:
+    # Undo and redo of whole-document commands. Page contents are stored
+    # compressed and by digest, so a page changed by several commands in a row
+    # keeps each of its versions once. The oldest entries are dropped when the
+    # stored contents pass the memory budget.
+    def __init__(self, max_bytes=None):
+        self.max_bytes = settings.get("undo_history_bytes") if max_bytes is None else max_bytes
+        self.blobs = {}
+        self.size = 0
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def push(self, entry):
+        for dropped in self.redo_stack:
+            self.release(dropped)
+        self.redo_stack.clear()
+        for digest, data in entry.blobs.items():
+            blob = self.blobs.get(digest)
+            if blob is None:
+                self.blobs[digest] = [data, 1]
+                self.size += len(data)
+            else:
+                blob[1] += 1
+        entry.blobs = None
+        self.undo_stack.append(entry)
+        # The newest entry stays even on its own over the budget, so the
+        # command that was just run can always be undone.
+        while len(self.undo_stack) > 1 and self.size > self.max_bytes:
+            self.release(self.undo_stack.pop(0))
+
+    def release(self, entry):
+        for digest in entry.digests():
+            blob = self.blobs[digest]
+            blob[1] -= 1
+            if not blob[1]:
+                del self.blobs[digest]
+                self.size -= len(blob[0])
+
+    def content(self, digest):
+        return zlib.decompress(self.blobs[digest][0]).decode('utf-8')
+
+    def undo(self, current_content):
+        # Returns the entry and the page contents to restore. Pages edited
+        # since the command ran are left as they are.
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        return entry, self.restore(entry, current_content, 1, 0)
+
+    def redo(self, current_content):
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry, self.restore(entry, current_content, 0, 1)
+
+    def restore(self, entry, current_content, expected, restored):
+        pages = {}
+        for page_num, digests in entry.pages.items():
+            if content_digest(current_content(page_num)) == digests[expected]:
+                pages[page_num] = self.content(digests[restored])
+        return pages
+
+    def clear(self):
+        self.blobs.clear()
+        self.size = 0
+        self.undo_stack.clear()
+        self.redo_stack.clear()
@@ -0,0 +1,485 @@
+import html
+import threading
+from array import array
+from collections import OrderedDict
+
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QBrush, QColor, QTextBlockFormat, QTextCharFormat, QTextCursor, QTextDocument, QTextFormat
+
+from settings import settings
+
+# Pages as blocks of text runs, each run pointing into a table of interned
+# formats, instead of the HTML QTextEdit.toHtml() produces. Edited pages are
+# written back as compact HTML without the per-page boilerplate, and their
+# model rebuilds the page on the next visit without parsing it.
+# Only what the model can hold exactly is converted: pages with links, lists
+# or tables raise UnsupportedContent and stay plain HTML.
+
+P = QTextFormat.Property
+
+CHAR_PROPERTIES = frozenset(int(prop) for prop in (
+    P.FontFamilies, P.FontPointSize, P.FontPixelSize, P.FontWeight, P.FontItalic,
+    P.FontUnderline, P.TextUnderlineStyle, P.FontOverline, P.FontStrikeOut, P.ForegroundBrush,
+))
+BLOCK_PROPERTIES = frozenset(int(prop) for prop in (
+    P.LayoutDirection, P.BlockAlignment, P.BlockTopMargin, P.BlockBottomMargin, P.BlockLeftMargin,
+    P.BlockRightMargin, P.TextIndent, P.BlockIndent, P.LineHeight, P.LineHeightType,
+))
+IMAGE_PROPERTIES = frozenset(int(prop) for prop in (P.ObjectType, P.ImageName, P.ImageWidth, P.ImageHeight))
+RUN_PROPERTIES = CHAR_PROPERTIES | IMAGE_PROPERTIES
+# Qt numbers the objects of each document itself.
+IGNORED_PROPERTIES = frozenset([int(P.ObjectIndex)])
+MARGINS = (
+    (P.BlockTopMargin, 'margin-top'), (P.BlockBottomMargin, 'margin-bottom'),
+    (P.BlockLeftMargin, 'margin-left'), (P.BlockRightMargin, 'margin-right'),
+)
+# Properties CSS can only set together.
+PROPERTY_GROUPS = {
+    int(P.FontUnderline): 'decoration', int(P.TextUnderlineStyle): 'decoration',
+    int(P.FontOverline): 'decoration', int(P.FontStrikeOut): 'decoration',
+    int(P.FontPointSize): 'size', int(P.FontPixelSize): 'size',
+}
+PROPORTIONAL_HEIGHT = 1
+ALIGNMENTS = {1: 'left', 2: 'right', 4: 'center', 8: 'justify'}
+DIRECTIONS = {0: 'ltr', 1: 'rtl'}
+LINE_SEPARATOR = '\u2028'
+OBJECT_REPLACEMENT = '\ufffc'
+PAGE_HEAD = (
+    '<html><head><style type="text/css">p { white-space: pre-wrap; margin-top:0px; margin-bottom:0px; }</style>'
+    '</head>'
+)
+PAGE_TAIL = '</body></html>'
+
+
+class UnsupportedContent(Exception):
+    pass
+
+
+class FormatTable:
+    # Formats as sorted tuples of (property, value), each stored once and
+    # referred to by its index. Shared by every page, so equal formats on
+    # different pages are the same id.
+    def __init__(self):
+        self.formats = []
+        self.ids = {}
+        self.merges = {}
+        self.lock = threading.Lock()
+
+    def intern(self, properties):
+        format_id = self.ids.get(properties)
+        if format_id is None:
+            with self.lock:
+                format_id = self.ids.get(properties)
+                if format_id is None:
+                    format_id = self.ids[properties] = len(self.formats)
+                    self.formats.append(properties)
+        return format_id
+
+    def __getitem__(self, format_id):
+        return self.formats[format_id]
+
+    def merged(self, base_id, format_id):
+        # format_id with the properties of base_id it does not set itself.
+        key = (base_id, format_id)
+        merged_id = self.merges.get(key)
+        if merged_id is None:
+            properties = dict(self.formats[base_id])
+            properties.update(self.formats[format_id])
+            merged_id = self.merges[key] = self.intern(tuple(sorted(properties.items())))
+        return merged_id
+
+    def is_image(self, format_id):
+        return format_value(self.formats[format_id], P.ObjectType) is not None
+
+
+format_table = FormatTable()
+
+
+def format_value(properties, prop, default=None):
+    for key, value in properties:
+        if key == prop:
+            return value
+    return default
+
+
+class Block:
+    # run_ends[i] is where run i ends in text; it has format run_formats[i].
+    # char_format is the format of the block itself, used when it is empty.
+    __slots__ = ('text', 'format', 'char_format', 'run_ends', 'run_formats')
+
+    def __init__(self, text, format_id, char_format, run_ends, run_formats):
+        self.text = text
+        self.format = format_id
+        self.char_format = char_format
+        self.run_ends = run_ends
+        self.run_formats = run_formats
+
+    def runs(self):
+        start = 0
+        for end, format_id in zip(self.run_ends, self.run_formats):
+            yield self.text[start:end], format_id
+            start = end
+
+
+class PageModel:
+    # default_format is the font of the document the page came from, which
+    # applies wherever the formats do not set their own.
+    __slots__ = ('blocks', 'default_format')
+
+    def __init__(self, blocks, default_format=None):
+        self.blocks = blocks
+        self.default_format = default_format
+
+    def __len__(self):
+        return sum(len(block.text) + 1 for block in self.blocks)
+
+    def resolved(self):
+        # The same page with the default font merged into every format, as
+        # it has to be written for a document with another default font.
+        if self.default_format is None:
+            return self
+        default = self.default_format
+        merged = {}
+
+        def merge(format_id):
+            merged_id = merged.get(format_id)
+            if merged_id is None:
+                merged_id = merged[format_id] = format_table.merged(default, format_id)
+            return merged_id
+        return PageModel([
+            Block(block.text, block.format, merge(block.char_format), block.run_ends,
+                  array('I', map(merge, block.run_formats)))
+            for block in self.blocks
+        ])
+
+    def image_sizes(self):
+        # Display sizes of the images on the page, by source, as image_store
+        # reads them from the HTML.
+        sizes = {}
+        for block in self.blocks:
+            for format_id in block.run_formats:
+                if format_table.is_image(format_id):
+                    properties = format_table[format_id]
+                    width = round(format_value(properties, P.ImageWidth, 0))
+                    height = round(format_value(properties, P.ImageHeight, 0))
+                    if width > 0 and height > 0:
+                        sizes[format_value(properties, P.ImageName, '')] = (width, height)
+        return sizes
+
+
+def intern_format(text_format, known):
+    properties = []
+    for prop, value in text_format.properties().items():
+        if prop in IGNORED_PROPERTIES:
+            continue
+        if prop not in known:
+            raise UnsupportedContent(f"format property {prop}")
+        if isinstance(value, list):
+            value = tuple(value)
+        elif prop == P.ObjectType and value != QTextFormat.ImageObject:
+            raise UnsupportedContent("object type")
+        elif isinstance(value, QBrush):
+            if value.style() != Qt.SolidPattern or value.color().alpha() != 255:
+                raise UnsupportedContent("brush")
+            value = value.color().name()
+        properties.append((prop, value))
+    return format_table.intern(tuple(sorted(properties)))
+
+
+def from_document(document):
+    # The HTML import leaves an empty frame behind for each image.
+    if any(frame.firstPosition() <= frame.lastPosition() for frame in document.rootFrame().childFrames()):
+        raise UnsupportedContent("frames or tables")
+    # The document keeps each distinct format once too; its indexes map to ours.
+    formats = document.allFormats()
+    char_ids = {}
+    block_ids = {}
+
+    def char_id(index):
+        format_id = char_ids.get(index)
+        if format_id is None:
+            format_id = char_ids[index] = intern_format(formats[index], RUN_PROPERTIES)
+        return format_id
+
+    blocks = []
+    block = document.begin()
+    while block.isValid():
+        if block.textList() is not None:
+            raise UnsupportedContent("lists")
+        run_ends, run_formats = array('I'), array('I')
+        length = 0
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            length += fragment.length()
+            format_id = char_id(fragment.charFormatIndex())
+            if run_formats and run_formats[-1] == format_id:
+                run_ends[-1] = length
+            else:
+                run_ends.append(length)
+                run_formats.append(format_id)
+            iterator += 1
+        block_id = block_ids.get(block.blockFormatIndex())
+        if block_id is None:
+            block_id = block_ids[block.blockFormatIndex()] = intern_format(block.blockFormat(), BLOCK_PROPERTIES)
+        blocks.append(Block(block.text(), block_id, char_id(block.charFormatIndex()), run_ends, run_formats))
+        block = block.next()
+    return PageModel(blocks, font_format(document.defaultFont()))
+
+
+def font_format(font):
+    # The properties toHtml writes on <body> for the default font.
+    properties = [
+        (int(P.FontFamilies), tuple(font.families() or [font.family()])),
+        (int(P.FontWeight), int(font.weight())),
+        (int(P.FontItalic), font.italic()),
+    ]
+    if font.pointSizeF() > 0:
+        properties.append((int(P.FontPointSize), font.pointSizeF()))
+    else:
+        properties.append((int(P.FontPixelSize), font.pixelSize()))
+    return format_table.intern(tuple(sorted(properties)))
+
+
+def to_text_format(properties, text_format):
+    for prop, value in properties:
+        if prop == P.ForegroundBrush:
+            value = QBrush(QColor(value))
+        elif isinstance(value, tuple):
+            value = list(value)
+        text_format.setProperty(prop, value)
+    return text_format
+
+
+def to_document(model, document=None):
+    # Builds the page straight from the model, without going through HTML.
+    if document is None:
+        document = QTextDocument()
+    document.clear()
+    model = model.resolved()
+    char_formats = {}
+    block_formats = {}
+
+    def char_format(format_id):
+        if format_id not in char_formats:
+            char_formats[format_id] = to_text_format(format_table[format_id], QTextCharFormat())
+        return char_formats[format_id]
+
+    def block_format(format_id):
+        if format_id not in block_formats:
+            block_formats[format_id] = to_text_format(format_table[format_id], QTextBlockFormat())
+        return block_formats[format_id]
+
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    for index, block in enumerate(model.blocks):
+        if index == 0:
+            cursor.setBlockFormat(block_format(block.format))
+            cursor.setBlockCharFormat(char_format(block.char_format))
+        else:
+            cursor.insertBlock(block_format(block.format), char_format(block.char_format))
+        for text, format_id in block.runs():
+            cursor.insertText(text, char_format(format_id))
+    cursor.endEditBlock()
+    return document
+
+
+def font_css(properties):
+    # Point and pixel sizes can both be set; the pixel size goes on an inner span.
+    css = []
+    pixel_size = None
+    decorations = []
+    decorations_set = False
+    for prop, value in properties:
+        if prop == P.FontFamilies:
+            css.append('font-family:' + ','.join(f"'{family}'" for family in value) + ';')
+        elif prop == P.FontPointSize:
+            css.append(f'font-size:{value:g}pt;')
+        elif prop == P.FontPixelSize:
+            pixel_size = value
+        elif prop == P.FontWeight:
+            css.append(f'font-weight:{value};')
+        elif prop == P.FontItalic:
+            css.append('font-style:italic;' if value else 'font-style:normal;')
+        elif prop == P.ForegroundBrush:
+            css.append(f'color:{value};')
+        elif prop in (P.FontUnderline, P.FontOverline, P.FontStrikeOut):
+            decorations_set = True
+            if value:
+                decorations.append({P.FontUnderline: 'underline', P.FontOverline: 'overline'}.get(prop, 'line-through'))
+    if decorations_set:
+        css.append(f"text-decoration: {' '.join(decorations) or 'none'};")
+    if pixel_size is not None and format_value(properties, P.FontPointSize) is None:
+        css.append(f'font-size:{pixel_size}px;')
+        pixel_size = None
+    return ' '.join(css), pixel_size
+
+
+def block_css(properties):
+    # Missing margins are 0, which PAGE_HEAD makes the default.
+    css = []
+    for prop, name in MARGINS:
+        margin = format_value(properties, prop)
+        if margin:
+            css.append(f'{name}:{margin:g}px;')
+    indent = format_value(properties, P.BlockIndent)
+    if indent is not None:
+        css.append(f'-qt-block-indent:{indent};')
+    text_indent = format_value(properties, P.TextIndent)
+    if text_indent is not None:
+        css.append(f'text-indent:{text_indent:g}px;')
+    line_height = format_value(properties, P.LineHeight)
+    if line_height is not None:
+        if format_value(properties, P.LineHeightType) != PROPORTIONAL_HEIGHT:
+            raise UnsupportedContent("line height type")
+        css.append(f'line-height:{line_height:g}%;')
+    attributes = ''
+    alignment = format_value(properties, P.BlockAlignment)
+    if alignment is not None:
+        if alignment not in ALIGNMENTS:
+            raise UnsupportedContent("alignment")
+        attributes += f' align="{ALIGNMENTS[alignment]}"'
+    direction = format_value(properties, P.LayoutDirection)
+    if direction is not None:
+        if direction not in DIRECTIONS:
+            raise UnsupportedContent("layout direction")
+        attributes += f' dir="{DIRECTIONS[direction]}"'
+    return ' '.join(css), attributes
+
+
+def escape_text(text):
+    return html.escape(text, quote=False).replace(LINE_SEPARATOR, '<br />')
+
+
+def image_tag(properties):
+    tag = f'<img src="{html.escape(format_value(properties, P.ImageName, ""))}"'
+    width = format_value(properties, P.ImageWidth)
+    if width is not None:
+        tag += f' width="{width:g}"'
+    height = format_value(properties, P.ImageHeight)
+    if height is not None:
+        tag += f' height="{height:g}"'
+    return tag + ' />'
+
+
+def run_properties(properties, inherited):
+    # What a span inside a paragraph with the inherited format has to set to
+    # give a run its format, or None if the run lacks a property it would
+    # inherit. Decorations and sizes are set together, as CSS sets them.
+    own = dict(properties)
+    if any(prop not in own for prop, _ in inherited):
+        return None
+    parent = dict(inherited)
+    changed = {PROPERTY_GROUPS.get(prop, prop) for prop, value in properties if parent.get(prop, own) != value}
+    return tuple((prop, value) for prop, value in properties if PROPERTY_GROUPS.get(prop, prop) in changed)
+
+
+def span_tags(properties):
+    if not properties:
+        return '', ''
+    css, pixel_size = font_css(properties)
+    if pixel_size is None:
+        return f'<span style="{css}">', '</span>'
+    return f'<span style="{css}"><span style="font-size:{pixel_size}px;">', '</span></span>'
+
+
+def body_format(model):
+    # The paragraph format most paragraphs share goes on <body>, if every
+    # paragraph can inherit it.
+    counts = {}
+    for block in model.blocks:
+        counts[block.char_format] = counts.get(block.char_format, 0) + 1
+    if not counts:
+        return ()
+    properties = format_table[max(counts, key=counts.get)]
+    if font_css(properties)[1] is not None:
+        return ()
+    if any(run_properties(format_table[format_id], properties) is None for format_id in counts):
+        return ()
+    return properties
+
+
+def to_html(model):
+    # The format most paragraphs share goes on <body>, the rest of each
+    # paragraph's on its <p>; spans only set what their run changes, so plain
+    # runs are plain text.
+    model = model.resolved()
+    body = body_format(model)
+    out = [PAGE_HEAD, f'<body style="{font_css(body)[0]}">' if body else '<body>']
+    block_styles = {}
+    paragraph_styles = {}
+    spans = {}
+    images = {}
+
+    def span(format_id, inherited_id):
+        # Tags around a run in a paragraph of format inherited_id, or None if
+        # the run cannot be written relative to it.
+        key = (format_id, inherited_id)
+        if key not in spans:
+            properties = format_table[format_id]
+            if format_table.is_image(format_id):
+                properties = tuple(item for item in properties if item[0] not in IMAGE_PROPERTIES)
+            if inherited_id is not None:
+                properties = run_properties(properties, format_table[inherited_id])
+            spans[key] = None if properties is None else span_tags(properties)
+        return spans[key]
+
+    def run_html(text, format_id):
+        if format_id not in images:
+            images[format_id] = image_tag(format_table[format_id]) if format_table.is_image(format_id) else None
+        if images[format_id] is None:
+            return escape_text(text)
+        # Every object character of an image run is one image.
+        return images[format_id] * len(text)
+
+    for block in model.blocks:
+        if block.format not in block_styles:
+            block_styles[block.format] = block_css(format_table[block.format])
+        css, attributes = block_styles[block.format]
+        if block.char_format not in paragraph_styles:
+            paragraph_styles[block.char_format] = font_css(run_properties(format_table[block.char_format], body))
+        char_css, pixel_size = paragraph_styles[block.char_format]
+        runs = None
+        if pixel_size is None:
+            runs = [(text, format_id, span(format_id, block.char_format)) for text, format_id in block.runs()]
+        if runs is None or any(tags is None for _, _, tags in runs):
+            # A paragraph cannot carry two font sizes, and a run cannot drop
+            # what it would inherit: such paragraphs spell out every run.
+            char_css = ''
+            runs = [(text, format_id, span(format_id, None)) for text, format_id in block.runs()]
+        if not block.text:
+            out.append(f'<p style="-qt-paragraph-type:empty; {css} {char_css}"{attributes}><br /></p>')
+            continue
+        out.append(f'<p style="{css} {char_css}"{attributes}>')
+        for text, format_id, (start_tags, end_tags) in runs:
+            out.append(start_tags + run_html(text, format_id) + end_tags)
+        out.append('</p>')
+    out.append(PAGE_TAIL)
+    return ''.join(out)
+
+
+class PageModelCache:
+    # Models by page version. Pages written back from the editor leave their
+    # model here, so the next visit needs no parsing.
+    # A version cached with None is a page the model cannot hold.
+    def __init__(self, max_pages=None):
+        self.max_pages = settings.get("page_model_cache_pages") if max_pages is None else max_pages
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version):
+        with self.lock:
+            model = self.pages.get(version)
+            if model is not None:
+                self.pages.move_to_end(version)
+            return model
+
+    def put(self, version, model):
+        with self.lock:
+            self.pages[version] = model
+            self.pages.move_to_end(version)
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+
+
+page_model_cache = PageModelCache()
@@ -0,0 +1,118 @@
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Qt, Signal, Slot
+from PySide6.QtWidgets import QMessageBox, QProgressDialog
+
+from document_history import HistoryEntry
+from tracing import tracer
+
+
+class WorkerSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
+    failed = Signal(str)
+
+
+class DocumentWorker(QRunnable):
+    def __init__(self, command, pages):
+        super().__init__()
+        self.command = command
+        # A snapshot, so that the pages it reads are the ones it was started on.
+        self.pages = pages
+        self.cancelled = False
+        self.done = threading.Event()
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            pages = list(self.pages)
+            changed_pages = self.command.transform_pages(
+                pages, self.signals.progress.emit, lambda: self.cancelled, list(self.pages.versions)
+            )
+            # Compressing the undo record here keeps it off the GUI thread.
+            entry = None
+            if changed_pages:
+                entry = HistoryEntry(type(self.command).__name__, pages, changed_pages)
+        except Exception as e:
+            self.done.set()
+            self.signals.failed.emit(str(e))
+            return
+        self.done.set()
+        self.signals.finished.emit((changed_pages, entry))
+
+
+class DocumentTask(QObject):
+    def __init__(self, editor_widget, command):
+        super().__init__(editor_widget)
+        self.editor_widget = editor_widget
+        self.command = command
+
+        self.dialog = QProgressDialog(
+            "Applying to the whole document...", "Cancel", 0, editor_widget.file_manager.num_pages, editor_widget
+        )
+        self.dialog.setWindowTitle("Whole Doc")
+        self.dialog.setWindowModality(Qt.WindowModal)
+        self.dialog.setMinimumDuration(500)
+
+        self.worker = None
+
+    def start(self):
+        self.editor_widget.document_task = self
+        self.command.prepare_pages()
+        self.worker = DocumentWorker(self.command, self.editor_widget.file_manager.snapshot())
+        self.worker.signals.progress.connect(self.dialog.setValue)
+        self.worker.signals.finished.connect(self.on_finished)
+        self.worker.signals.failed.connect(self.on_failed)
+        self.dialog.canceled.connect(self.worker.cancel)
+        # Edits typed before the progress dialog shows up would be lost on commit.
+        self.editor_widget.set_read_only(True)
+        QThreadPool.globalInstance().start(self.worker)
+
+    def cancel(self):
+        # Returns once the worker has stopped reading the pages.
+        self.worker.cancel()
+        self.worker.done.wait()
+
+    def finish(self):
+        self.dialog.reset()
+        self.editor_widget.set_read_only(False)
+        self.editor_widget.document_task = None
+        self.deleteLater()
+
+    def pages_unchanged(self, changed_pages):
+        # Opening another document or reloading pages while the command ran
+        # gives them new versions, which the result must not overwrite.
+        versions = self.editor_widget.file_manager.data["pages"].versions
+        started = self.worker.pages.versions
+        return all(page_num < len(versions) and versions[page_num] == started[page_num] for page_num in changed_pages)
+
+    @Slot(object)
+    def on_finished(self, result):
+        self.finish()
+        changed_pages, entry = result
+        if changed_pages and not self.pages_unchanged(changed_pages):
+            self.editor_widget.status_changed.emit("The document changed while the command ran; it was not applied")
+            changed_pages = entry = None
+        # A cancelled run reports no pages, which leaves the document as it was.
+        if changed_pages is not None:
+            with tracer.span('commit', 'document', command=type(self.command).__name__, pages=len(changed_pages)):
+                self.command.commit(changed_pages)
+        if entry is not None:
+            self.editor_widget.push_history(entry)
+        self.editor_widget.run_pending_work()
+
+    @Slot(str)
+    def on_failed(self, message):
+        self.finish()
+        QMessageBox.critical(self.editor_widget, "Error", f"Failed to apply to the whole document: {message}")
+        self.editor_widget.run_pending_work()
+
+
+def run_document_command(editor_widget, command):
+    # One whole-document command runs at a time. Each one reads the pages when
+    # it starts, so two running together would overwrite each other's result.
+    editor_widget.flush_document_batch()
+    editor_widget.run_document_work(lambda: DocumentTask(editor_widget, command).start())
@@ -1,18 +1,34 @@
 import webbrowser
 
 from PySide6 import QtWidgets
-from PySide6.QtCore import Qt, QUrl
-from PySide6.QtGui import QDesktopServices
-from PySide6.QtWidgets import QTextEdit, QWidget, QApplication
+from PySide6.QtCore import Qt, QTimer, QUrl, Signal
+from PySide6.QtGui import QDesktopServices, QKeySequence, QTextDocument
+from PySide6.QtWidgets import QPlainTextDocumentLayout, QPlainTextEdit, QTextEdit, QWidget, QApplication, QMessageBox
 
+from document_history import DocumentHistory
+from document_model import OBJECT_REPLACEMENT
 from file_manager import FileManager
 from navigation_widget import NavigationWidget
+from page_cache import PageDocumentCache
+from plain_page import is_large_text, large_page_characters, plain_page_html
+from save_worker import SaveTask
+from settings import settings
 
 
 class CustomTextEdit(QTextEdit):
+    # Text that would make the page large is handed over instead of being laid out here.
+    large_paste = Signal(str)
+
     def __init__(self):
         super().__init__()
 
+    def insertFromMimeData(self, source):
+        # characterCount also counts the paragraph separator after the last block.
+        if source.hasText() and is_large_text(len(source.text()) + self.document().characterCount() - 1):
+            self.large_paste.emit(source.text())
+            return
+        super().insertFromMimeData(source)
+
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton and QApplication.keyboardModifiers() == Qt.ControlModifier:
             anchor = self.anchorAt(event.pos())
@@ -26,61 +42,395 @@ class CustomTextEdit(QTextEdit):
         super().mousePressEvent(event)
 
 
+class PlainPageEdit(QPlainTextEdit):
+    # Typing into a read-only page is reported, so that a large page with
+    # formatting can ask to be edited as plain text.
+    edit_refused = Signal()
+    EDIT_KEYS = frozenset([Qt.Key_Backspace, Qt.Key_Delete, Qt.Key_Return, Qt.Key_Enter, Qt.Key_Tab])
+
+    def keyPressEvent(self, event):
+        super().keyPressEvent(event)
+        if self.isReadOnly() and (
+                event.text().isprintable() and event.text() or event.key() in self.EDIT_KEYS
+                or event.matches(QKeySequence.Paste) or event.matches(QKeySequence.Cut)):
+            self.edit_refused.emit()
+
+
 class EditorWidget(QWidget):
+    modification_changed = Signal(bool)
+    status_changed = Signal(str)
+    history_changed = Signal()
+
     def __init__(self, file_name=None):
         super().__init__()
         self.layout = QtWidgets.QGridLayout()
         self.setLayout(self.layout)
         self.text_edit = CustomTextEdit()
+        self.text_edit.large_paste.connect(self.paste_into_large_page, Qt.QueuedConnection)
+        # Large pages are shown here instead of in text_edit. The hidden view is
+        # left on an empty document, so formatting commands have nothing to
+        # change and an evicted page is never left behind in it.
+        self.plain_edit = PlainPageEdit()
+        self.plain_edit.textChanged.connect(self.on_plain_text_changed)
+        self.plain_edit.edit_refused.connect(self.confirm_plain_text, Qt.QueuedConnection)
+        self.plain_edit.hide()
+        self.large_page = False
+        # The large page shown still has its formatting in the file.
+        self.formatted_page = False
+        # Set while a whole-document command runs.
+        self.read_only = False
+        self.plain_characters = 0
+        self.blank_document = QTextDocument(self)
+        self.blank_plain_document = QTextDocument(self)
+        self.blank_plain_document.setDocumentLayout(QPlainTextDocumentLayout(self.blank_plain_document))
+        self.plain_edit.setDocument(self.blank_plain_document)
+        # The document of the page being left. The page cache may evict it
+        # before show_document replaces it, so it is kept alive until then.
+        self.leaving_document = None
         self.navigation_widget = NavigationWidget(self)
         self.navigation_widget.setFixedSize(200, 50)
 
         self.layout.addWidget(self.text_edit, 1, 0, 1, 3)
+        self.layout.addWidget(self.plain_edit, 1, 0, 1, 3)
         self.layout.addWidget(self.navigation_widget, 2, 1, 1, 1)
 
         self.file_manager = FileManager()
+        self.page_cache = PageDocumentCache(
+            self.file_manager, self.text_edit.font(), self.on_document_modification_changed
+        )
         self.current_page = 0
+        self.history = DocumentHistory()
+        # The whole-document command running and the work waiting for it:
+        # commands and undos, each as a function that starts it.
+        self.document_task = None
+        self.pending_document_commands = []
+        # Whole Doc formatting clicked in quick succession runs as one pipeline.
+        self.pending_pipeline = None
+        self.batch_timer = QTimer(self)
+        self.batch_timer.setSingleShot(True)
+        self.batch_timer.setInterval(settings.get("document_batch_delay_ms"))
+        self.batch_timer.timeout.connect(self.flush_document_batch)
+
+        # Neighbouring pages are parsed ahead of time once the event loop is idle.
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(0)
+        self.prefetch_timer.timeout.connect(self.prefetch_adjacent_pages)
+
+        self.save_task = None
+        # A save asked for while a whole-document command runs, as (file_name, automatic).
+        self.pending_save = None
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        if settings.get("autosave_interval_s") > 0:
+            self.autosave_timer.start(settings.get("autosave_interval_s") * 1000)
 
         if file_name:
             self.load_file(file_name)
 
     def new_file(self):
+        self.cancel_document_commands()
+        self.wait_for_save()
         self.file_manager.new_file()
-        self.set_current_page(0)
+        self.current_page = 0
+        self.clear_history()
+        self.reload_pages()
 
     def load_file(self, file_name):
+        self.cancel_document_commands()
+        self.wait_for_save()
         self.file_manager.load_file(file_name)
-        self.set_current_page(0)
+        self.current_page = 0
+        self.clear_history()
+        self.reload_pages()
+
+    def save_file(self, file_name, automatic=False):
+        # A save reopens the file the running command still reads its pages
+        # from, so it waits for the command.
+        if self.document_task is not None:
+            self.pending_save = (file_name, automatic)
+            self.status_changed.emit("Saving once the whole-document command is done")
+            return
+        self.start_save(file_name, automatic)
+
+    def start_save(self, file_name, automatic):
+        # Only the pages edited in the page cache are serialized here; the file
+        # is written in the background from a snapshot.
+        self.wait_for_save()
+        self.save_pages_content()
+        self.save_task = SaveTask(self, file_name, automatic)
+        self.save_task.finished.connect(self.on_save_finished)
+        self.status_changed.emit("Autosaving..." if automatic else "Saving...")
+        self.save_task.start()
+
+    def cancel_document_commands(self):
+        # Whole-document commands belong to the document they were started on.
+        self.batch_timer.stop()
+        self.pending_pipeline = None
+        self.pending_document_commands.clear()
+        if self.document_task is not None:
+            self.document_task.cancel()
+        # The command no longer reads the file, and the save was asked for before the document goes.
+        if self.pending_save is not None:
+            file_name, automatic = self.pending_save
+            self.pending_save = None
+            self.start_save(file_name, automatic)
+
+    def batch_document_command(self, command, new_pipeline):
+        if self.pending_pipeline is None:
+            self.pending_pipeline = new_pipeline(self)
+        self.pending_pipeline.add(command)
+        self.batch_timer.start()
+
+    def flush_document_batch(self):
+        # Anything else done to the whole document comes after the batch.
+        self.batch_timer.stop()
+        pipeline, self.pending_pipeline = self.pending_pipeline, None
+        if pipeline is not None:
+            pipeline.execute()
+
+    def run_document_work(self, start):
+        # Whole-document work reads the pages when it starts, so it runs once the
+        # work before it is done. A save in progress replaces the file the pages are read from.
+        if self.document_task is None and self.save_task is None and not self.pending_document_commands:
+            start()
+            return
+        self.pending_document_commands.append(start)
+        if self.document_task is not None or self.save_task is None:
+            self.status_changed.emit("Waiting for the whole-document command that is running")
+        else:
+            self.status_changed.emit("Waiting for the save to finish")
+
+    def run_pending_work(self):
+        # Saves and whole-document work wait for each other, in the order they were asked for.
+        while self.save_task is None and self.document_task is None:
+            if self.pending_save is not None:
+                file_name, automatic = self.pending_save
+                self.pending_save = None
+                self.start_save(file_name, automatic)
+            elif self.pending_document_commands:
+                self.pending_document_commands.pop(0)()
+            else:
+                return
+
+    def wait_for_save(self):
+        if self.save_task is not None:
+            self.save_task.wait()
+
+    def on_save_finished(self, succeeded):
+        automatic = self.save_task.automatic
+        self.save_task = None
+        if succeeded:
+            self.status_changed.emit("Autosaved" if automatic else "Saved")
+        else:
+            self.status_changed.emit("Save failed")
+        self.modification_changed.emit(self.is_modified())
+        self.run_pending_work()
+
+    def autosave(self):
+        if self.save_task is None and self.pending_save is None and self.file_manager.file_name and self.is_modified():
+            self.save_file(self.file_manager.file_name, automatic=True)
+
+    def push_history(self, entry):
+        self.history.push(entry)
+        self.history_changed.emit()
+
+    def clear_history(self):
+        self.history.clear()
+        self.history_changed.emit()
+
+    def undo_document_command(self):
+        # Whole-document commands reload the pages they change, which leaves
+        # nothing for the text edit's own undo; they are undone here instead,
+        # after the commands asked for before.
+        self.flush_document_batch()
+        self.run_document_work(self.undo_last_document_command)
 
-    def save_file(self, file_name):
-        self.save_current_page_content()
-        self.file_manager.save_file(file_name)
+    def redo_document_command(self):
+        self.flush_document_batch()
+        self.run_document_work(self.redo_last_document_command)
+
+    def undo_last_document_command(self):
+        if not self.history.can_undo():
+            return
+        self.save_pages_content()
+        entry, pages = self.history.undo(self.file_manager.get_page_content)
+        self.restore_history_pages(entry, pages, "Undone")
+
+    def redo_last_document_command(self):
+        if not self.history.can_redo():
+            return
+        self.save_pages_content()
+        entry, pages = self.history.redo(self.file_manager.get_page_content)
+        self.restore_history_pages(entry, pages, "Redone")
+
+    def restore_history_pages(self, entry, pages, action):
+        self.file_manager.replace_pages(pages)
+        self.reload_pages(pages)
+        skipped = len(entry.pages) - len(pages)
+        message = f"{action}: whole-document change on {len(pages)} pages"
+        if skipped:
+            message += f", {skipped} pages edited since were left as they are"
+        self.status_changed.emit(message)
+        self.history_changed.emit()
+
+    def dirty_pages(self):
+        # Pages that differ from the saved file, whether or not they were serialized yet.
+        return sorted(set(self.file_manager.dirty_pages) | set(self.page_cache.modified_pages()))
+
+    def is_modified(self):
+        return bool(self.page_cache.modified_pages() or self.file_manager.dirty_pages)
+
+    def on_document_modification_changed(self, _):
+        self.modification_changed.emit(self.is_modified())
 
     def set_current_page(self, page_num):
+        self.leaving_document = self.page_edit().document()
         self.current_page = page_num
         self.navigation_widget.update_page_number()
-        page_content = self.file_manager.get_page_content(self.current_page)
-        self.text_edit.setHtml(page_content)
+        self.show_document(self.page_cache.document(self.current_page))
+        self.prefetch_timer.start()
+
+    def page_edit(self):
+        # The view the current page is edited in.
+        return self.plain_edit if self.large_page else self.text_edit
+
+    def show_document(self, document):
+        if document.plain:
+            self.plain_characters = document.characterCount() - 1
+            self.plain_edit.setDocument(document)
+            self.text_edit.setDocument(self.blank_document)
+        else:
+            self.text_edit.setDocument(document)
+            self.plain_characters = 0
+            self.plain_edit.setDocument(self.blank_plain_document)
+        self.leaving_document = None
+        self.formatted_page = document.plain and document.formatted
+        self.plain_edit.setReadOnly(self.read_only or self.formatted_page)
+        if document.plain != self.large_page:
+            self.large_page = document.plain
+            self.plain_edit.setVisible(self.large_page)
+            self.text_edit.setVisible(not self.large_page)
+        if self.formatted_page:
+            self.status_changed.emit(
+                f"Page {self.current_page + 1} is over {large_page_characters()} characters and is shown as plain text;"
+                " it keeps its formatting unless you edit it"
+            )
+
+    def set_read_only(self, read_only):
+        self.read_only = read_only
+        self.text_edit.setReadOnly(read_only)
+        self.plain_edit.setReadOnly(read_only or self.formatted_page)
+
+    def confirm_plain_text(self):
+        # Editing a large page in the plain view writes it back without its formatting.
+        if not self.formatted_page or self.read_only:
+            return
+        answer = QMessageBox.question(
+            self, "Large page",
+            f"Page {self.current_page + 1} is over {large_page_characters()} characters and can only be edited as"
+            " plain text. Edit it and remove its formatting and images?"
+        )
+        if answer != QMessageBox.Yes or not self.formatted_page:
+            return
+        self.plain_edit.document().formatted = False
+        self.formatted_page = False
+        self.plain_edit.setReadOnly(self.read_only)
+        self.status_changed.emit(f"Page {self.current_page + 1} is edited as plain text")
+
+    def refuse_rich_edit(self):
+        # Formatting, images and links go to text_edit, which is left on an
+        # empty document while a large page is shown in the plain view.
+        if not self.large_page:
+            return False
+        self.status_changed.emit(
+            f"Page {self.current_page + 1} is over {large_page_characters()} characters and is edited as plain text"
+        )
+        return True
+
+    def paste_into_large_page(self, text):
+        # The page is moved to the plain view with the text pasted where the
+        # selection was. Images have no place in plain text and are dropped.
+        self.leaving_document = self.text_edit.document()
+        if self.leaving_document.characterCount() > 1:
+            answer = QMessageBox.question(
+                self, "Large page",
+                f"After this paste page {self.current_page + 1} is over {large_page_characters()} characters and can"
+                " only be edited as plain text. Paste and remove the formatting and images of the page?"
+            )
+            if answer != QMessageBox.Yes:
+                self.leaving_document = None
+                self.status_changed.emit("Nothing was pasted")
+                return
+        cursor = self.text_edit.textCursor()
+        page_text = self.text_edit.toPlainText()
+        head = page_text[:cursor.selectionStart()].replace(OBJECT_REPLACEMENT, '') + text
+        tail = page_text[cursor.selectionEnd():].replace(OBJECT_REPLACEMENT, '')
+        self.show_document(self.page_cache.replace_text(self.current_page, head + tail, plain=True))
+        cursor = self.plain_edit.textCursor()
+        cursor.setPosition(len(head))
+        self.plain_edit.setTextCursor(cursor)
+        self.status_changed.emit(
+            f"Page {self.current_page + 1} is over {large_page_characters()} characters and is edited as plain text"
+        )
+
+    def on_plain_text_changed(self):
+        # The page goes back to rich text once it shrinks under half the
+        # threshold, so that edits around the threshold do not switch views back and forth.
+        characters = self.plain_edit.document().characterCount() - 1
+        limit = large_page_characters() // 2
+        if characters < limit <= self.plain_characters:
+            # Not while the plain view is still handling the edit.
+            QTimer.singleShot(0, self.leave_large_page)
+        self.plain_characters = characters
+
+    def leave_large_page(self):
+        document = self.plain_edit.document()
+        if not self.large_page or document.characterCount() - 1 >= large_page_characters() // 2:
+            return
+        position = self.plain_edit.textCursor().position()
+        self.show_document(self.page_cache.replace_text(self.current_page, document.toPlainText(), plain=False))
+        cursor = self.text_edit.textCursor()
+        cursor.setPosition(position)
+        self.text_edit.setTextCursor(cursor)
+        self.status_changed.emit(f"Page {self.current_page + 1} is rich text again")
+
+    def prefetch_adjacent_pages(self):
+        for page_num in (self.current_page + 1, self.current_page - 1):
+            if page_num not in self.page_cache and 0 <= page_num < self.file_manager.num_pages:
+                self.page_cache.prefetch(page_num)
+                self.prefetch_timer.start()
+                return
 
     def get_current_page_content(self):
+        if self.large_page:
+            return plain_page_html(self.plain_edit.toPlainText())
         return self.text_edit.toHtml()
 
     def save_current_page_content(self):
-        self.file_manager.set_page_content(self.current_page, self.get_current_page_content())
+        self.page_cache.write_back(self.current_page)
+
+    def save_pages_content(self):
+        self.page_cache.flush()
+
+    def reload_pages(self, page_nums=None):
+        self.leaving_document = self.page_edit().document()
+        if page_nums is None:
+            self.page_cache.clear()
+        else:
+            self.page_cache.invalidate(page_nums)
+        self.update_current_page()
+        self.modification_changed.emit(self.is_modified())
 
     def update_current_page(self):
         self.set_current_page(self.current_page)
 
     def next_page(self):
-        self.save_current_page_content()
-        self.current_page += 1
-        if self.current_page >= self.file_manager.num_pages:
+        if self.current_page + 1 >= self.file_manager.num_pages:
             self.file_manager.new_page()
-        self.update_current_page()
+        self.set_current_page(self.current_page + 1)
 
     def previous_page(self):
         if self.current_page <= 0:
             return
-        self.save_current_page_content()
-        self.current_page -= 1
-        self.update_current_page()
+        self.set_current_page(self.current_page - 1)
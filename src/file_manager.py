@@ -1,35 +1,74 @@
-import gzip
 import json
 
 from PySide6.QtWidgets import QMessageBox, QWidget
 
+from document_container import ContainerFormatError, PageList, finish_save, open_pages, save_pages
+from page_text import page_text_cache
+from search_index import SearchIndex, index_file_name
+
+LOAD_ERRORS = (OSError, EOFError, UnicodeDecodeError, json.JSONDecodeError, ContainerFormatError)
+
 
 class FileManager:
     def __init__(self):
         self.file_name = None
-        self.data = {"pages": []}
+        self.data = {"pages": PageList()}
+        self.search_index = SearchIndex()
 
     def new_file(self):
+        self.close()
         self.file_name = None
-        self.data = {"pages": [""]}
+        self.data = {"pages": PageList([""])}
+        self.search_index = SearchIndex()
 
     def save_file(self, file_name):
-        compressed_data = gzip.compress(json.dumps(self.data).encode('utf-8'))
-        with open(file_name, 'wb') as file:
-            file.write(compressed_data)
+        self.data["pages"] = save_pages(self.data["pages"], file_name)
+        self.file_name = file_name
+        self.save_search_index()
+
+    def snapshot(self):
+        return self.data["pages"].snapshot()
+
+    def index_save_job(self, snapshot):
+        # Writes the search index sidecar of snapshot once the pages are saved.
+        return self.search_index.save_job(snapshot)
+
+    def finish_save(self, snapshot, file_name, temp_name, index_job=None):
+        # Completes a save of snapshot written by write_pages on another thread.
+        self.data["pages"] = finish_save(self.data["pages"], snapshot, file_name, temp_name)
         self.file_name = file_name
+        if index_job is not None:
+            index_job.finish()
+
+    def save_search_index(self):
+        # The index is only a cache; a document that saved fine is not failed over it.
+        try:
+            self.search_index.save(self.data["pages"], index_file_name(self.file_name))
+        except OSError:
+            pass
+
+    def compact(self):
+        if self.file_name:
+            self.data["pages"] = save_pages(self.data["pages"], self.file_name, compact=True)
 
     def load_file(self, file_name):
         try:
-            with gzip.open(file_name, 'rb') as file:
-                json_data = file.read()
-            self.data = json.loads(json_data)
-        except (OSError, json.JSONDecodeError):
+            self.open_file(file_name)
+        except LOAD_ERRORS:
             QMessageBox.critical(
                 QWidget(), "Error loading file", "Failed to load file: invalid format"
             )
-            return
+
+    def open_file(self, file_name):
+        # Like load_file, but raises LOAD_ERRORS instead of showing them.
+        pages = open_pages(file_name)
+        self.close()
+        self.data = {"pages": pages}
         self.file_name = file_name
+        self.search_index = SearchIndex.load(index_file_name(file_name))
+
+    def close(self):
+        self.data["pages"].close()
 
     def get_page_content(self, page_num):
         try:
@@ -39,13 +78,40 @@ class FileManager:
 
     def set_page_content(self, page_num, content):
         if page_num < len(self.data["pages"]):
+            # Rewriting a page with the content it already has would make it dirty for no reason.
+            if not self.data["pages"].is_dirty(page_num) and self.data["pages"][page_num] == content:
+                return
             self.data["pages"][page_num] = content
         else:
             self.data["pages"].append(content)
 
+    def replace_pages(self, changed_pages):
+        for page_num, content in changed_pages.items():
+            self.data["pages"][page_num] = content
+
     def new_page(self):
         self.data["pages"].append("")
 
+    def add_image(self, data):
+        return self.data["pages"].add_image(data)
+
+    def image_data(self, digest):
+        return self.data["pages"].image_data(digest)
+
+    def page_version(self, page_num):
+        return self.data["pages"].versions[page_num]
+
+    def page_text(self, page_num):
+        return page_text_cache.get(self.page_version(page_num), self.get_page_content(page_num))
+
+    def find_all(self, query):
+        self.search_index.refresh(self.data["pages"])
+        return self.search_index.find(self.data["pages"], query)
+
+    @property
+    def dirty_pages(self):
+        return self.data["pages"].dirty_pages
+
     @property
     def num_pages(self):
         return len(self.data["pages"])
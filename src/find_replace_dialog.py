@@ -1,7 +1,13 @@
-from PySide6.QtWidgets import QDialog, QLabel, QLineEdit, QCheckBox, QPushButton, QVBoxLayout
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (
+    QDialog, QLabel, QLineEdit, QCheckBox, QPushButton, QVBoxLayout, QListWidget, QListWidgetItem
+)
 
 from commands import FindReplaceRegExpDocumentCommand, FindReplaceStringDocumentCommand
 
+MAX_RESULTS = 1000
+SNIPPET_CONTEXT = 30
+
 
 class FindReplaceDialog(QDialog):
     def __init__(self, parent=None):
@@ -14,8 +20,13 @@ class FindReplaceDialog(QDialog):
         self.replaceLineEdit = QLineEdit()
         self.regexpCheckbox = QCheckBox("Regular expressions")
         self.replaceAllButton = QPushButton("Replace All")
+        self.findAllButton = QPushButton("Find All")
+        self.resultsList = QListWidget()
+        self.resultsQuery = ""
 
         self.replaceAllButton.clicked.connect(self.replace)
+        self.findAllButton.clicked.connect(self.find_all)
+        self.resultsList.itemClicked.connect(self.show_result)
 
         layout = QVBoxLayout()
         layout.addWidget(self.findLabel)
@@ -24,6 +35,8 @@ class FindReplaceDialog(QDialog):
         layout.addWidget(self.replaceLineEdit)
         layout.addWidget(self.regexpCheckbox)
         layout.addWidget(self.replaceAllButton)
+        layout.addWidget(self.findAllButton)
+        layout.addWidget(self.resultsList)
 
         self.setLayout(layout)
 
@@ -38,3 +51,34 @@ class FindReplaceDialog(QDialog):
             FindReplaceStringDocumentCommand(self.parent().editor_widget, find_text, replace_text).execute()
 
         self.close()
+
+    def find_all(self):
+        find_text = self.findLineEdit.text()
+        if not find_text:
+            return
+        editor_widget = self.parent().editor_widget
+        editor_widget.save_pages_content()
+        file_manager = editor_widget.file_manager
+
+        self.resultsList.clear()
+        self.resultsQuery = find_text
+        for page_num, start, end in file_manager.find_all(find_text)[:MAX_RESULTS]:
+            text = file_manager.page_text(page_num).text
+            snippet = text[max(start - SNIPPET_CONTEXT, 0):end + SNIPPET_CONTEXT].replace('\n', ' ')
+            item = QListWidgetItem(f"Page {page_num + 1}: {snippet}")
+            item.setData(Qt.UserRole, (page_num, start))
+            self.resultsList.addItem(item)
+
+    def show_result(self, item):
+        page_num, start = item.data(Qt.UserRole)
+        editor_widget = self.parent().editor_widget
+        editor_widget.set_current_page(page_num)
+        # Page text offsets follow the document's own positions closely enough
+        # to pick the right occurrence when searching from just before them.
+        page_edit = editor_widget.page_edit()
+        document = page_edit.document()
+        cursor = document.find(self.resultsQuery, max(start - 1, 0))
+        if cursor.isNull():
+            cursor = document.find(self.resultsQuery)
+        if not cursor.isNull():
+            page_edit.setTextCursor(cursor)
@@ -0,0 +1,283 @@
+import re
+from bisect import bisect_right
+
+# Streaming rewriter for the HTML subset produced by QTextEdit.toHtml. It walks
+# the markup once, keeping only the stack of open element names, and emits the
+# input unchanged except for wrapped text runs and rewritten style attributes.
+
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr',
+])
+RAW_TEXT_ELEMENTS = frozenset(['script', 'style', 'textarea', 'title'])
+
+TAG_RE = re.compile(
+    r'''<(?:'''
+    r'''(!--.*?--)'''
+    r'''|([!?][^>]*)'''
+    r'''|/([A-Za-z][^\s/>]*)\s*'''
+    r'''|([A-Za-z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)'''
+    r''')>''',
+    re.S
+)
+RAW_TEXT_END_RE = {name: re.compile(f'</{name}\\s*>', re.I) for name in RAW_TEXT_ELEMENTS}
+ATTR_RE = re.compile(r'''([^\s=/>"']+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>"']+))?''')
+
+
+class UnsupportedMarkup(ValueError):
+    pass
+
+
+def parse_attributes(text):
+    attributes = []
+    for match in ATTR_RE.finditer(text):
+        name, value = match.group(1).lower(), match.group(2)
+        if value is None:
+            value = ''
+        elif value[0] in '"\'':
+            value = value[1:-1]
+        attributes.append([name, value])
+    return attributes
+
+
+def format_start_tag(name, attributes, self_closing):
+    parts = [name]
+    for attr_name, value in attributes:
+        parts.append(f'{attr_name}="{value.replace(chr(34), "&quot;")}"')
+    return f'<{" ".join(parts)}{" /" if self_closing else ""}>'
+
+
+class StreamTransformer:
+    # Transforms are objects with wrap_text(parent_name) returning a
+    # (tag name, style or None) wrapper or None, and rewrite_style(tag_name,
+    # style) returning the new style or None. They are applied in order, so a
+    # wrapper added by one transform is seen by the ones after it. Transforms
+    # with a false rewrites_style attribute leave every start tag untouched.
+    def __init__(self, transforms):
+        self.transforms = list(transforms)
+        self.rewrites_style = any(getattr(transform, 'rewrites_style', True) for transform in self.transforms)
+        self._wrappers = {}
+        self._tags = {}
+
+    def wrappers_for(self, parent_name):
+        cached = self._wrappers.get(parent_name)
+        if cached is not None:
+            return cached
+        key = parent_name
+
+        created = []
+        for index, transform in enumerate(self.transforms):
+            wrapper = transform.wrap_text(parent_name)
+            if wrapper is None:
+                continue
+            name, style = wrapper
+            created.append((index, name, style))
+            parent_name = name
+
+        opening, closing = [], []
+        for index, name, style in created:
+            for transform in self.transforms[index:]:
+                style = transform.rewrite_style(name, style)
+            opening.append(format_start_tag(name, [] if style is None else [['style', style]], False))
+            closing.append(f'</{name}>')
+        closing.reverse()
+        cached = (''.join(opening), ''.join(closing))
+        self._wrappers[key] = cached
+        return cached
+
+    def rewrite_tag(self, raw, name, attribute_text, self_closing):
+        if not self.rewrites_style:
+            return raw
+        cached = self._tags.get(raw)
+        if cached is not None:
+            return cached
+
+        attributes = parse_attributes(attribute_text)
+        style_index = next((i for i, (attr_name, _) in enumerate(attributes) if attr_name == 'style'), None)
+        style = attributes[style_index][1] if style_index is not None else None
+        new_style = style
+        for transform in self.transforms:
+            new_style = transform.rewrite_style(name, new_style)
+
+        if new_style == style:
+            result = raw
+        else:
+            if style_index is None:
+                attributes.append(['style', new_style])
+            else:
+                attributes[style_index][1] = new_style
+            result = format_start_tag(name, attributes, self_closing)
+        self._tags[raw] = result
+        return result
+
+    def transform(self, content):
+        out = []
+        append = out.append
+        stack = []
+        # Text inside <head> (style sheets, titles) is never formatted.
+        head_depth = 0
+        pos = 0
+        length = len(content)
+
+        while pos < length:
+            start = content.find('<', pos)
+            if start < 0:
+                start = length
+            if start > pos:
+                text = content[pos:start]
+                if head_depth:
+                    append(text)
+                else:
+                    opening, closing = self.wrappers_for(stack[-1] if stack else None)
+                    append(opening)
+                    append(text)
+                    append(closing)
+                if start == length:
+                    break
+
+            match = TAG_RE.match(content, start)
+            if match is None:
+                raise UnsupportedMarkup(f"unexpected '<' at offset {start}")
+            pos = match.end()
+
+            if match.group(1) is not None or match.group(2) is not None:
+                append(match.group(0))
+                continue
+
+            end_name = match.group(3)
+            if end_name is not None:
+                end_name = end_name.lower()
+                if not stack or stack[-1] != end_name:
+                    raise UnsupportedMarkup(f"unbalanced </{end_name}> at offset {start}")
+                stack.pop()
+                if end_name == 'head':
+                    head_depth -= 1
+                append(match.group(0))
+                continue
+
+            name = match.group(4).lower()
+            attribute_text = match.group(5)
+            self_closing = attribute_text.endswith('/')
+            if self_closing:
+                attribute_text = attribute_text[:-1]
+            append(self.rewrite_tag(match.group(0), name, attribute_text, self_closing))
+
+            if name in RAW_TEXT_ELEMENTS and not self_closing:
+                close = RAW_TEXT_END_RE[name].search(content, pos)
+                if close is None:
+                    raise UnsupportedMarkup(f"unterminated <{name}>")
+                append(content[pos:close.start()])
+                append(close.group(0))
+                pos = close.end()
+            elif name not in VOID_ELEMENTS and not self_closing:
+                stack.append(name)
+                if name == 'head':
+                    head_depth += 1
+
+        if stack:
+            raise UnsupportedMarkup(f"unclosed <{stack[-1]}>")
+        return ''.join(out)
+
+
+class SpanStyleTransformer:
+    # Gives every body text run the given style through a span: the nearest
+    # enclosing span gets the style, or a new span is wrapped around the text.
+    # Each run is wrapped in inline_tags, and strip_tags are removed from every
+    # span that was restyled. Span start tags are patched in the output once
+    # the span is closed and it is known whether it held any text.
+    def __init__(self, style, inline_tags, strip_tags):
+        self.style = style
+        self.opening = ''.join(f'<{name}>' for name in inline_tags)
+        self.closing = ''.join(f'</{name}>' for name in reversed(inline_tags))
+        self.new_span = format_start_tag('span', [['style', style]], False)
+        self.strip_tags = frozenset(strip_tags)
+
+    def restyle_span(self, attribute_text):
+        attributes = [attribute for attribute in parse_attributes(attribute_text) if attribute[0] != 'style']
+        attributes.append(['style', self.style])
+        return format_start_tag('span', attributes, False)
+
+    def transform(self, content):
+        out = []
+        append = out.append
+        stack = []
+        # For each open span: output index of its start tag, its attribute text, whether it holds text.
+        spans = []
+        # Output indices of the strip_tags tags not removed yet, in increasing order.
+        strip_positions = []
+        head_depth = 0
+        pos = 0
+        length = len(content)
+
+        while pos < length:
+            start = content.find('<', pos)
+            if start < 0:
+                start = length
+            if start > pos:
+                text = content[pos:start]
+                if head_depth:
+                    append(text)
+                elif spans:
+                    spans[-1][2] = True
+                    append(self.opening + text + self.closing)
+                else:
+                    append(self.new_span + self.opening + text + self.closing + '</span>')
+                if start == length:
+                    break
+
+            match = TAG_RE.match(content, start)
+            if match is None:
+                raise UnsupportedMarkup(f"unexpected '<' at offset {start}")
+            pos = match.end()
+
+            if match.group(1) is not None or match.group(2) is not None:
+                append(match.group(0))
+                continue
+
+            end_name = match.group(3)
+            if end_name is not None:
+                end_name = end_name.lower()
+                if not stack or stack[-1] != end_name:
+                    raise UnsupportedMarkup(f"unbalanced </{end_name}> at offset {start}")
+                stack.pop()
+                if end_name == 'head':
+                    head_depth -= 1
+                elif end_name == 'span':
+                    span_index, attribute_text, has_text = spans.pop()
+                    if has_text:
+                        out[span_index] = self.restyle_span(attribute_text)
+                        first = bisect_right(strip_positions, span_index)
+                        for index in strip_positions[first:]:
+                            out[index] = ''
+                        del strip_positions[first:]
+                elif end_name in self.strip_tags and not head_depth:
+                    strip_positions.append(len(out))
+                append(match.group(0))
+                continue
+
+            name = match.group(4).lower()
+            attribute_text = match.group(5)
+            self_closing = attribute_text.endswith('/')
+            if name in RAW_TEXT_ELEMENTS and not self_closing:
+                close = RAW_TEXT_END_RE[name].search(content, pos)
+                if close is None:
+                    raise UnsupportedMarkup(f"unterminated <{name}>")
+                append(content[start:close.end()])
+                pos = close.end()
+                continue
+            if name not in VOID_ELEMENTS and not self_closing:
+                stack.append(name)
+                if name == 'head':
+                    head_depth += 1
+                elif name == 'span' and not head_depth:
+                    spans.append([len(out), attribute_text, False])
+                elif name in self.strip_tags and not head_depth:
+                    strip_positions.append(len(out))
+            append(match.group(0))
+
+        if stack:
+            raise UnsupportedMarkup(f"unclosed <{stack[-1]}>")
+        return ''.join(out)
+
+
+def transform_html(content, transforms):
+    return StreamTransformer(transforms).transform(content)
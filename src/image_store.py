@@ -0,0 +1,154 @@
+import re
+from collections import OrderedDict
+
+from PySide6.QtCore import QBuffer, QByteArray, QObject, QRunnable, QSize, Qt, QThreadPool, Signal, Slot
+from PySide6.QtGui import QColor, QGuiApplication, QImage, QImageIOHandler, QImageReader
+
+from document_container import IMAGE_URL_PREFIX
+from html_stream import parse_attributes
+from settings import settings
+
+IMG_TAG_RE = re.compile(r'<img\b((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.I)
+PLACEHOLDER_COLOR = QColor(235, 235, 235)
+
+
+def image_url(digest):
+    return IMAGE_URL_PREFIX + digest
+
+
+def url_digest(url):
+    name = url.toString()
+    if name.startswith(IMAGE_URL_PREFIX):
+        return name[len(IMAGE_URL_PREFIX):]
+    return None
+
+
+def image_sizes(content):
+    # Display sizes of the images on a page, by source, from their width and height attributes.
+    sizes = {}
+    for match in IMG_TAG_RE.finditer(content):
+        attributes = dict(parse_attributes(match.group(1)))
+        try:
+            width, height = round(float(attributes['width'])), round(float(attributes['height']))
+        except (KeyError, ValueError):
+            continue
+        if width > 0 and height > 0:
+            sizes[attributes.get('src', '')] = (width, height)
+    return sizes
+
+
+def device_size(width, height):
+    # Images are decoded at the resolution they are drawn at on the screen.
+    app = QGuiApplication.instance()
+    ratio = app.devicePixelRatio() if app else 1
+    return QSize(round(width * ratio), round(height * ratio))
+
+
+def image_reader(data):
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QBuffer.ReadOnly)
+    reader = QImageReader(buffer)
+    reader.setAutoTransform(True)
+    # The reader does not keep its device alive.
+    return reader, buffer
+
+
+def decode_image(data, size=None):
+    reader, _buffer = image_reader(data)
+    if size is None:
+        return reader.read()
+    full_size = reader.size()
+    if full_size.isValid():
+        size = size.boundedTo(full_size)
+    # Formats that can decode straight to a smaller size never hold the full image.
+    if reader.supportsOption(QImageIOHandler.ScaledSize):
+        reader.setScaledSize(size)
+        return reader.read()
+    image = reader.read()
+    if image.isNull() or image.size() == size:
+        return image
+    return image.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def placeholder_image(size):
+    image = QImage(size if size.isValid() else QSize(1, 1), QImage.Format_RGB32)
+    image.fill(PLACEHOLDER_COLOR)
+    return image
+
+
+class ImageDecodeSignals(QObject):
+    decoded = Signal(object, object)
+
+
+class ImageDecodeTask(QRunnable):
+    def __init__(self, key, data, size):
+        super().__init__()
+        self.key = key
+        self.data = data
+        self.size = size
+        self.signals = ImageDecodeSignals()
+
+    def run(self):
+        self.signals.decoded.emit(self.key, decode_image(self.data, self.size))
+
+
+class ImageCache(QObject):
+    # Decoded images by content digest and display size, shared by every page
+    # that shows them. QImage is implicitly shared, so documents holding an
+    # image cost nothing extra. Images not decoded yet are decoded on the
+    # thread pool; callers get a placeholder of the right size until then.
+    def __init__(self, max_bytes=None):
+        super().__init__()
+        self.max_bytes = settings.get("image_cache_bytes") if max_bytes is None else max_bytes
+        self.images = OrderedDict()
+        self.size = 0
+        self.pending = {}
+
+    def request(self, digest, load_data, display_size, callback):
+        # Returns the image, a placeholder while it is decoded, or None if there
+        # is no such image. callback(image) runs on the GUI thread once decoded.
+        size = device_size(*display_size) if display_size else None
+        key = (digest, None if size is None else (size.width(), size.height()))
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+
+        pending = self.pending.get(key)
+        if pending is None:
+            data = load_data()
+            if data is None:
+                return None
+            if size is None:
+                size = image_reader(data)[0].size()
+                task = ImageDecodeTask(key, data, None)
+            else:
+                task = ImageDecodeTask(key, data, size)
+            task.signals.decoded.connect(self.on_decoded)
+            pending = self.pending[key] = (task, size, [])
+            QThreadPool.globalInstance().start(task)
+        pending[2].append(callback)
+        return placeholder_image(pending[1])
+
+    @Slot(object, object)
+    def on_decoded(self, key, image):
+        _, _, callbacks = self.pending.pop(key)
+        if image.isNull():
+            return
+        self.put(key, image)
+        for callback in callbacks:
+            callback(image)
+
+    def put(self, key, image):
+        previous = self.images.pop(key, None)
+        if previous is not None:
+            self.size -= previous.sizeInBytes()
+        self.images[key] = image
+        self.size += image.sizeInBytes()
+        while len(self.images) > 1 and self.size > self.max_bytes:
+            _, evicted = self.images.popitem(last=False)
+            self.size -= evicted.sizeInBytes()
+
+
+image_cache = ImageCache()
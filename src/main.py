@@ -1,11 +1,42 @@
 import sys
+import time
 
-from PySide6.QtWidgets import QApplication
+started = time.perf_counter()
+
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from startup import StartupReport, report_path  # noqa: E402
+from text_processor import TextProcessor  # noqa: E402
+
+
+def run_startup_report(app, text_processor, report):
+    # Opens an empty editor after the start window is painted and quits once
+    # the editor is painted too.
+    def editor_painted():
+        report.mark("editor first paint")
+        report.write()
+        app.quit()
+
+    def start_window_painted():
+        report.mark("start window first paint")
+        text_processor.create_new_file()
+        report.mark("editor created")
+        report.on_first_paint(text_processor.editor_widget, editor_painted)
+
+    report.on_first_paint(text_processor.start_window, start_window_painted)
 
-from text_processor import TextProcessor
 
 if __name__ == '__main__':
+    path = report_path(sys.argv)
+    report = StartupReport(started, path) if path is not None else None
+    if report:
+        report.mark("imports")
     app = QApplication(sys.argv)
+    if report:
+        report.mark("application")
     text_processor = TextProcessor()
+    if report:
+        report.mark("main window")
+        run_startup_report(app, text_processor, report)
     text_processor.show()
     sys.exit(app.exec())
@@ -1,8 +1,9 @@
 from PySide6 import QtWidgets
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QWidget, QPushButton, QLabel
 
+from assets import icon
+
 
 class NavigationWidget(QWidget):
     def __init__(self, editor_widget) -> None:
@@ -12,11 +13,11 @@ class NavigationWidget(QWidget):
         self.setLayout(self.layout)
 
         self.left_button = QPushButton()
-        self.left_button.setIcon(QIcon("../resources/left_arrow.png"))
+        self.left_button.setIcon(icon('left_arrow.png'))
         self.left_button.setToolTip('Previous page')
 
         self.right_button = QPushButton()
-        self.right_button.setIcon(QIcon("../resources/right_arrow.png"))
+        self.right_button.setIcon(icon('right_arrow.png'))
         self.right_button.setToolTip('Next page')
 
         self.page_number = QLabel('Page: 1')
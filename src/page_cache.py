@@ -0,0 +1,195 @@
+from collections import OrderedDict
+
+from PySide6.QtGui import QTextDocument
+from PySide6.QtWidgets import QPlainTextDocumentLayout
+
+from document_model import UnsupportedContent, from_document, page_model_cache, to_document, to_html
+from image_store import image_cache, image_sizes, url_digest
+from plain_page import is_large_text, is_plain_page, plain_page_html, plain_page_text
+from settings import settings
+from tracing import tracer
+
+
+class PageDocument(QTextDocument):
+    # Embedded images are decoded off the GUI thread on first display, at the
+    # size they are shown at, and replace a placeholder once they are ready.
+    def __init__(self, file_manager):
+        super().__init__()
+        self.file_manager = file_manager
+        self.image_sizes = {}
+        # Large pages are laid out by QPlainTextEdit, one visible block at a time.
+        self.plain = False
+        # A large page shown without the formatting it has in the file. It is
+        # read-only until the user agrees to edit it as plain text.
+        self.formatted = False
+
+    def set_page_html(self, content):
+        self.image_sizes = image_sizes(content)
+        self.setHtml(content)
+
+    def set_page_model(self, model):
+        self.image_sizes = model.image_sizes()
+        to_document(model, self)
+
+    def set_page_text(self, text, plain=False):
+        if plain:
+            self.setDocumentLayout(QPlainTextDocumentLayout(self))
+            self.plain = True
+        self.setPlainText(text)
+
+    def set_image_size(self, name, width, height):
+        self.image_sizes[name] = (width, height)
+
+    def loadResource(self, resource_type, url):
+        if resource_type == QTextDocument.ImageResource:
+            digest = url_digest(url)
+            if digest is not None:
+                image = image_cache.request(
+                    digest,
+                    lambda: self.file_manager.image_data(digest),
+                    self.image_sizes.get(url.toString()),
+                    lambda decoded: self.on_image_decoded(url, decoded),
+                )
+                if image is not None:
+                    return image
+        return super().loadResource(resource_type, url)
+
+    def on_image_decoded(self, url, image):
+        self.addResource(QTextDocument.ImageResource, url, image)
+        self.markContentsDirty(0, self.characterCount())
+
+
+class PageDocumentCache:
+    # Parsed documents of recently visited pages, most recent last. Edited
+    # documents are only serialized back into the file manager when they are
+    # evicted or flushed.
+    def __init__(self, file_manager, default_font=None, on_modification_changed=None):
+        self.file_manager = file_manager
+        self.default_font = default_font
+        self.on_modification_changed = on_modification_changed
+        self.max_pages = settings.get("page_cache_pages")
+        self.max_characters = settings.get("page_cache_characters")
+        self.documents = OrderedDict()
+
+    def __contains__(self, page_num):
+        return page_num in self.documents
+
+    def new_document(self):
+        document = PageDocument(self.file_manager)
+        if self.default_font is not None:
+            document.setDefaultFont(self.default_font)
+        return document
+
+    def build_document(self, page_num):
+        document = self.new_document()
+        content = self.file_manager.get_page_content(page_num)
+        large_text = self.large_page_text(page_num, content)
+        model = None if large_text is not None else page_model_cache.get(self.file_manager.page_version(page_num))
+        if large_text is not None:
+            with tracer.span('setPlainText', 'page', page=page_num, characters=len(large_text)):
+                document.set_page_text(large_text, plain=True)
+            document.formatted = not is_plain_page(content)
+        elif model is not None:
+            with tracer.span('to_document', 'page', page=page_num, characters=len(model)):
+                document.set_page_model(model)
+        elif is_plain_page(content):
+            with tracer.span('setPlainText', 'page', page=page_num, characters=len(content)):
+                document.set_page_text(plain_page_text(content))
+        else:
+            with tracer.span('setHtml', 'page', page=page_num, characters=len(content)):
+                document.set_page_html(content)
+        self.add_document(document, modified=False)
+        return document
+
+    def large_page_text(self, page_num, content):
+        # The text of a large page, or None. Text is never longer than the HTML
+        # it comes from, so most pages are ruled out without extracting it.
+        if not is_large_text(len(content)):
+            return None
+        if is_plain_page(content):
+            text = plain_page_text(content)
+        else:
+            text = self.file_manager.page_text(page_num).text
+        return text if is_large_text(len(text)) else None
+
+    def add_document(self, document, modified):
+        document.setModified(modified)
+        if self.on_modification_changed is not None:
+            document.modificationChanged.connect(self.on_modification_changed)
+
+    def replace_text(self, page_num, text, plain):
+        # Moves an open page between the plain and the rich view, keeping only its text.
+        document = self.new_document()
+        with tracer.span('setPlainText', 'page', page=page_num, characters=len(text)):
+            document.set_page_text(text, plain)
+        self.add_document(document, modified=True)
+        self.documents[page_num] = document
+        if self.on_modification_changed is not None:
+            self.on_modification_changed(True)
+        return document
+
+    def document(self, page_num):
+        document = self.documents.get(page_num)
+        if document is None:
+            document = self.documents[page_num] = self.build_document(page_num)
+        self.documents.move_to_end(page_num)
+        self.evict(keep=page_num)
+        return document
+
+    def prefetch(self, page_num):
+        if page_num in self.documents or not 0 <= page_num < self.file_manager.num_pages:
+            return
+        self.documents[page_num] = self.build_document(page_num)
+        self.documents.move_to_end(page_num, last=False)
+
+    def characters(self):
+        # Plain documents only lay out what is visible, so only the page limit applies to them.
+        return sum(document.characterCount() for document in self.documents.values() if not document.plain)
+
+    def evict(self, keep):
+        while len(self.documents) > 1 and (
+                len(self.documents) > self.max_pages or self.characters() > self.max_characters):
+            page_num = next(iter(self.documents))
+            if page_num == keep:
+                self.documents.move_to_end(page_num)
+                page_num = next(iter(self.documents))
+            self.write_back(page_num)
+            del self.documents[page_num]
+
+    def write_back(self, page_num):
+        document = self.documents.get(page_num)
+        if document is None or not document.isModified():
+            return
+        if document.plain:
+            model = None
+            with tracer.span('toPlainText', 'page', page=page_num):
+                content = plain_page_html(document.toPlainText())
+        else:
+            # Pages the model can hold are written as its compact HTML, and the
+            # model is kept for the next visit.
+            try:
+                with tracer.span('write_model', 'page', page=page_num):
+                    model = from_document(document)
+                    content = to_html(model)
+            except UnsupportedContent:
+                model = None
+                with tracer.span('toHtml', 'page', page=page_num):
+                    content = document.toHtml()
+        self.file_manager.set_page_content(page_num, content)
+        page_model_cache.put(self.file_manager.page_version(page_num), model)
+        document.setModified(False)
+
+    def flush(self):
+        for page_num in self.modified_pages():
+            self.write_back(page_num)
+
+    def modified_pages(self):
+        # Pages edited since they were parsed or last written back.
+        return [page_num for page_num, document in self.documents.items() if document.isModified()]
+
+    def invalidate(self, page_nums):
+        for page_num in page_nums:
+            self.documents.pop(page_num, None)
+
+    def clear(self):
+        self.documents.clear()
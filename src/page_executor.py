@@ -0,0 +1,42 @@
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from settings import settings
+
+_executor = None
+
+
+def worker_count():
+    count = settings.get("worker_count")
+    return count if count > 0 else os.cpu_count() or 1
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # The pool is started from a worker thread of a running Qt process. A
+        # forked child would inherit whatever locks other threads hold at that
+        # moment, so the workers are spawned instead.
+        _executor = ProcessPoolExecutor(max_workers=worker_count(), mp_context=multiprocessing.get_context('spawn'))
+        atexit.register(shutdown_executor)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def map_pages(function, pages):
+    # Yields results in page order; small documents are not worth the pickling overhead.
+    # Closing the iterator early cancels the pages that have not been started yet.
+    pages = list(pages)
+    workers = worker_count()
+    if workers <= 1 or len(pages) < settings.get("parallel_min_pages"):
+        return (function(page) for page in pages)
+    chunksize = max(1, len(pages) // (workers * 4))
+    return get_executor().map(function, pages, chunksize=chunksize)
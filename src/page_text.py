@@ -0,0 +1,196 @@
+import html
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from html_stream import RAW_TEXT_END_RE, RAW_TEXT_ELEMENTS, TAG_RE, VOID_ELEMENTS
+
+# Plain text of a page as the editor shows it, with a map back to the HTML it
+# came from, so searches see text and never markup.
+
+BLOCK_ELEMENTS = frozenset([
+    'blockquote', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'p', 'pre', 'td', 'th', 'tr',
+])
+# Whitespace directly inside these is layout between blocks, not page text.
+CONTAINER_ELEMENTS = frozenset([None, 'body', 'html', 'ol', 'table', 'tbody', 'thead', 'tr', 'ul'])
+ENTITY_RE = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);?')
+
+
+class PageText:
+    # Each segment maps text[text_starts[i]:text_ends[i]] to
+    # html[raw_starts[i]:raw_ends[i]]. Segments of equal length map character
+    # by character; others are single entities and only map as a whole.
+    # Block and line breaks appear in the text as '\n' without a segment.
+    __slots__ = ('text', 'text_starts', 'text_ends', 'raw_starts', 'raw_ends', 'breaks')
+
+    def __init__(self, text, text_starts, text_ends, raw_starts, raw_ends, breaks):
+        self.text = text
+        self.text_starts = text_starts
+        self.text_ends = text_ends
+        self.raw_starts = raw_starts
+        self.raw_ends = raw_ends
+        self.breaks = breaks
+
+    def crosses_break(self, start, end):
+        return bisect_left(self.breaks, start) != bisect_left(self.breaks, end)
+
+    def raw_ranges(self, start, end):
+        # HTML ranges holding text[start:end], one per segment it touches. An
+        # empty match maps to an empty range where its text position is.
+        first = max(bisect_right(self.text_starts, start) - 1, 0)
+        ranges = []
+        for index in range(first, len(self.text_starts)):
+            text_start, text_end = self.text_starts[index], self.text_ends[index]
+            if text_end < start or (text_end == start and start != end):
+                continue
+            if text_start >= end and start != end:
+                break
+            raw_start, raw_end = self.raw_starts[index], self.raw_ends[index]
+            if text_end - text_start == raw_end - raw_start:
+                raw_start, raw_end = raw_start + max(start - text_start, 0), raw_end - max(text_end - end, 0)
+            ranges.append((raw_start, raw_end))
+            if start == end:
+                break
+        return ranges
+
+
+def extract_text(content):
+    pieces = []
+    text_starts, text_ends = array('q'), array('q')
+    raw_starts, raw_ends = array('q'), array('q')
+    breaks = []
+    length = 0
+
+    def add_segment(raw_start, raw_end, text):
+        nonlocal length
+        text_starts.append(length)
+        raw_starts.append(raw_start)
+        raw_ends.append(raw_end)
+        pieces.append(text)
+        length += len(text)
+        text_ends.append(length)
+
+    def add_run(start, end):
+        pos = start
+        for entity in ENTITY_RE.finditer(content, start, end):
+            if entity.start() > pos:
+                add_segment(pos, entity.start(), content[pos:entity.start()])
+            add_segment(entity.start(), entity.end(), html.unescape(entity.group(0)))
+            pos = entity.end()
+        if end > pos:
+            add_segment(pos, end, content[pos:end])
+
+    def add_break():
+        nonlocal length
+        if length and (not breaks or breaks[-1] != length - 1):
+            breaks.append(length)
+            pieces.append('\n')
+            length += 1
+
+    stack = []
+    head_depth = 0
+    pos = 0
+    content_length = len(content)
+    while pos < content_length:
+        start = content.find('<', pos)
+        if start < 0:
+            start = content_length
+        if start > pos and not head_depth:
+            parent = stack[-1] if stack else None
+            if parent not in CONTAINER_ELEMENTS or not content[pos:start].isspace():
+                add_run(pos, start)
+        if start == content_length:
+            break
+
+        match = TAG_RE.match(content, start)
+        if match is None:
+            # A stray '<' is plain text.
+            add_run(start, start + 1)
+            pos = start + 1
+            continue
+        pos = match.end()
+
+        end_name = match.group(3)
+        if end_name is not None:
+            end_name = end_name.lower()
+            if end_name in stack:
+                while stack.pop() != end_name:
+                    pass
+                if end_name == 'head':
+                    head_depth -= 1
+            continue
+
+        name = match.group(4)
+        if name is None:
+            continue
+        name = name.lower()
+        self_closing = match.group(5).endswith('/')
+        if name in BLOCK_ELEMENTS or name == 'br':
+            add_break()
+        if name in RAW_TEXT_ELEMENTS and not self_closing:
+            close = RAW_TEXT_END_RE[name].search(content, pos)
+            pos = close.end() if close else content_length
+        elif name not in VOID_ELEMENTS and not self_closing:
+            stack.append(name)
+            if name == 'head':
+                head_depth += 1
+
+    return PageText(''.join(pieces), text_starts, text_ends, raw_starts, raw_ends, breaks)
+
+
+def replace_matches(content, page_text, matches):
+    # Applies every (start, end, replacement) text match in one pass over the
+    # HTML. The replacement goes where the match starts; the rest of the
+    # matched text is removed from whatever elements it spans.
+    edits = []
+    for start, end, replacement in matches:
+        if page_text.crosses_break(start, end):
+            continue
+        ranges = page_text.raw_ranges(start, end)
+        if not ranges:
+            continue
+        edits.append((ranges[0][0], ranges[0][1], html.escape(replacement, quote=False)))
+        edits.extend((raw_start, raw_end, '') for raw_start, raw_end in ranges[1:])
+
+    if not edits:
+        return content
+    edits.sort(key=lambda edit: edit[0])
+    out = []
+    pos = 0
+    for raw_start, raw_end, replacement in edits:
+        if raw_start < pos:
+            continue
+        out.append(content[pos:raw_start])
+        out.append(replacement)
+        pos = raw_end
+    out.append(content[pos:])
+    return ''.join(out)
+
+
+class PageTextCache:
+    # Extracted text keyed by page version, so a page is only extracted again
+    # after it has changed. Shared by the GUI thread and document workers.
+    def __init__(self, max_pages=512):
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version, content):
+        with self.lock:
+            page_text = self.pages.get(version)
+            if page_text is not None:
+                self.pages.move_to_end(version)
+                return page_text
+        # Extracted outside the lock; a page extracted twice at once is stored once.
+        page_text = extract_text(content)
+        with self.lock:
+            page_text = self.pages.setdefault(version, page_text)
+            self.pages.move_to_end(version)
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        return page_text
+
+
+page_text_cache = PageTextCache()
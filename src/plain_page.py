@@ -0,0 +1,40 @@
+import html
+
+from settings import settings
+
+# Pages with more text than the large_page_characters setting are edited as
+# plain text. Once edited they are stored as their escaped text in one fixed
+# element, which the editor recognizes and reads without parsing HTML, while
+# search, commands and older versions still see an ordinary page.
+
+PLAIN_PAGE_HEAD = '<html><body><pre style="white-space: pre-wrap">'
+PLAIN_PAGE_TAIL = '</pre></body></html>'
+
+
+def large_page_characters():
+    return settings.get("large_page_characters")
+
+
+def is_large_text(characters):
+    # Pages are measured by their text as the editor shows it, never by their
+    # HTML, which can be many times longer on a page with formatting.
+    return characters > large_page_characters()
+
+
+def is_plain_page(content):
+    return (
+        content.startswith(PLAIN_PAGE_HEAD) and content.endswith(PLAIN_PAGE_TAIL)
+        and content.find('<', len(PLAIN_PAGE_HEAD), len(content) - len(PLAIN_PAGE_TAIL)) < 0
+    )
+
+
+def plain_page_html(text):
+    return PLAIN_PAGE_HEAD + html.escape(text, quote=False) + PLAIN_PAGE_TAIL
+
+
+def plain_page_text(content):
+    # The text of a page is_plain_page accepts. Only the three entities
+    # html.escape writes are undone, which is many times faster than
+    # html.unescape on a page full of them.
+    text = content[len(PLAIN_PAGE_HEAD):len(content) - len(PLAIN_PAGE_TAIL)]
+    return text.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
@@ -0,0 +1,88 @@
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+from PySide6.QtWidgets import QMessageBox
+
+from document_container import open_pages, write_pages
+from document_worker import WorkerSignals
+from search_index import index_file_name
+
+
+class SaveWorker(QRunnable):
+    def __init__(self, snapshot, index_job, file_name):
+        super().__init__()
+        self.snapshot = snapshot
+        self.index_job = index_job
+        self.file_name = file_name
+        self.temp_name = None
+        self.error = None
+        self.done = threading.Event()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            self.temp_name = write_pages(self.snapshot, self.file_name)
+        except Exception as e:
+            self.error = str(e)
+        else:
+            self.write_index()
+        self.done.set()
+        self.signals.finished.emit(None)
+
+    def write_index(self):
+        # The index is only a cache; a document that saved fine is not failed
+        # over it. Its pages are keyed by the frames just written.
+        try:
+            written = open_pages(self.temp_name or self.file_name)
+        except (OSError, ValueError):
+            return
+        try:
+            self.index_job.write(written, index_file_name(self.file_name))
+        except OSError:
+            pass
+        finally:
+            written.close()
+
+
+class SaveTask(QObject):
+    # Writes a snapshot of the pages on the thread pool while editing goes on;
+    # the saved file is swapped in on the GUI thread once it is complete.
+    finished = Signal(bool)
+
+    def __init__(self, editor_widget, file_name, automatic=False):
+        super().__init__(editor_widget)
+        self.editor_widget = editor_widget
+        self.file_name = file_name
+        self.automatic = automatic
+        self.completed = False
+
+        snapshot = editor_widget.file_manager.snapshot()
+        self.worker = SaveWorker(snapshot, editor_widget.file_manager.index_save_job(snapshot), file_name)
+        self.worker.signals.finished.connect(self.complete)
+
+    def start(self):
+        QThreadPool.globalInstance().start(self.worker)
+
+    def wait(self):
+        # For anything that must not overlap a save, like loading another file.
+        self.worker.done.wait()
+        self.complete()
+
+    @Slot(object)
+    def complete(self, _=None):
+        if self.completed:
+            return
+        self.completed = True
+        succeeded = self.worker.error is None
+        if succeeded:
+            try:
+                self.editor_widget.file_manager.finish_save(
+                    self.worker.snapshot, self.file_name, self.worker.temp_name, self.worker.index_job
+                )
+            except OSError as e:
+                self.worker.error = str(e)
+                succeeded = False
+        if not succeeded and not self.automatic:
+            QMessageBox.critical(self.editor_widget, "Error", f"Failed to save file: {self.worker.error}")
+        self.finished.emit(succeeded)
+        self.deleteLater()
@@ -0,0 +1,245 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import zlib
+
+from page_text import page_text_cache
+
+INDEX_FORMAT = 1
+# The sidecar is a cache: fast compression writes it many times faster for a
+# file about a quarter larger.
+INDEX_COMPRESS_LEVEL = 1
+# Pages serialized per write: json.dump writes every token on its own, which
+# is slow, while one json.dumps of a large index holds all of it in memory.
+INDEX_BLOCK_PAGES = 256
+WORD_RE = re.compile(r'\w+')
+
+
+def index_file_name(file_name):
+    return file_name + '.idx'
+
+
+def page_key(pages, page_num):
+    # Identifies saved page content across sessions without decoding it. Dirty
+    # pages have no key until they are written to a container.
+    if pages.is_dirty(page_num):
+        return None
+    frame = pages.container.raw_frame(pages.frame_ref(page_num))
+    return hashlib.blake2b(frame, digest_size=16).hexdigest()
+
+
+def page_words(text):
+    words = {}
+    for match in WORD_RE.finditer(text):
+        words.setdefault(match.group(0).lower(), []).append(match.start())
+    return words
+
+
+def find_in_text(text, needle):
+    positions = []
+    start = text.find(needle)
+    while start >= 0:
+        positions.append(start)
+        start = text.find(needle, start + 1)
+    return positions
+
+
+def valid_entry(entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get("key"), (str, type(None))):
+        return False
+    words = entry.get("words", {})
+    return isinstance(words, dict) and all(
+        isinstance(positions, list) and all(type(start) is int for start in positions)
+        for positions in words.values()
+    )
+
+
+class SearchIndex:
+    # Lower-cased word positions in the text of each page, and the pages each
+    # word occurs on. Pages are indexed again only when their version changes;
+    # the sidecar file keys them by frame hash so the index outlives the session.
+    def __init__(self):
+        self.versions = []
+        self.keys = []
+        self.page_words = []
+        self.word_pages = {}
+        # The sidecar file name and page keys last written or loaded.
+        self.saved = None
+
+    def _add_entry(self, key=None, words=None):
+        self.versions.append(None)
+        self.keys.append(key)
+        self.page_words.append({})
+        self._set_words(len(self.page_words) - 1, words or {})
+
+    def _set_words(self, page_num, words):
+        for word in self.page_words[page_num]:
+            word_pages = self.word_pages[word]
+            word_pages.discard(page_num)
+            if not word_pages:
+                del self.word_pages[word]
+        self.page_words[page_num] = words
+        for word in words:
+            self.word_pages.setdefault(word, set()).add(page_num)
+
+    def refresh(self, pages):
+        while len(self.versions) < len(pages):
+            self._add_entry()
+        for page_num, version in enumerate(pages.versions):
+            if self.versions[page_num] == version:
+                continue
+            key = page_key(pages, page_num)
+            if key is None or key != self.keys[page_num]:
+                page_text = page_text_cache.get(version, pages[page_num])
+                self._set_words(page_num, page_words(page_text.text))
+            self.keys[page_num] = key
+            self.versions[page_num] = version
+
+    def words_matching(self, token, whole_start, whole_end):
+        # A query token cut off by the start or end of the query may be the end
+        # or start of a longer word, so those are matched against the vocabulary.
+        if whole_start and whole_end:
+            return [token] if token in self.word_pages else []
+        if whole_start:
+            return [word for word in self.word_pages if word.startswith(token)]
+        if whole_end:
+            return [word for word in self.word_pages if word.endswith(token)]
+        return [word for word in self.word_pages if token in word]
+
+    def find(self, pages, query):
+        # Every case-insensitive occurrence of query in the page texts as
+        # (page_num, start, end). Call refresh first.
+        needle = query.lower()
+        tokens = list(WORD_RE.finditer(needle))
+        if not tokens:
+            return self.scan(pages, needle, range(len(pages)))
+
+        candidates = None
+        token_words = []
+        for position, token in enumerate(tokens):
+            whole_start = position > 0 or token.start() > 0
+            whole_end = position < len(tokens) - 1 or token.end() < len(needle)
+            words = self.words_matching(token.group(0), whole_start, whole_end)
+            token_words.append(words)
+            token_pages = set()
+            for word in words:
+                token_pages |= self.word_pages[word]
+            candidates = token_pages if candidates is None else candidates & token_pages
+            if not candidates:
+                return []
+
+        if len(tokens) > 1 or tokens[0].group(0) != needle:
+            return self.scan(pages, needle, sorted(candidates))
+
+        # A single word needs no page text: its positions are in the index.
+        matches = []
+        for page_num in sorted(candidates):
+            words = self.page_words[page_num]
+            starts = []
+            for word in token_words[0]:
+                offsets = find_in_text(word, needle)
+                for word_start in words.get(word, ()):
+                    starts.extend(word_start + offset for offset in offsets)
+            matches.extend((page_num, start, start + len(needle)) for start in sorted(starts))
+        return matches
+
+    def scan(self, pages, needle, page_nums):
+        matches = []
+        for page_num in page_nums:
+            text = page_text_cache.get(pages.versions[page_num], pages[page_num]).text.lower()
+            matches.extend((page_num, start, start + len(needle)) for start in find_in_text(text, needle))
+        return matches
+
+    @classmethod
+    def load(cls, file_name):
+        index = cls()
+        try:
+            with gzip.open(file_name, 'rt', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, EOFError, ValueError, zlib.error):
+            # The sidecar is only a cache: a damaged one is dropped as a whole
+            # instead of failing the document it belongs to.
+            return index
+        if not isinstance(data, dict) or data.get("format") != INDEX_FORMAT:
+            return index
+        entries = data.get("pages", [])
+        if not isinstance(entries, list) or not all(valid_entry(entry) for entry in entries):
+            return index
+        for entry in entries:
+            index._add_entry(entry.get("key"), entry.get("words"))
+        index.saved = (file_name, list(index.keys))
+        return index
+
+    def save_job(self, pages):
+        return SidecarSave(self, pages)
+
+    def save(self, pages, file_name):
+        job = self.save_job(pages)
+        job.write(pages, file_name)
+        job.finish()
+
+
+class SidecarSave:
+    # Saving the index of a document, started on the GUI thread from a copy of
+    # the index and the pages being saved. write runs with the save, off the
+    # GUI thread, and finish hands the new page keys back to the index.
+    def __init__(self, index, pages):
+        self.index = index
+        self.versions = list(index.versions)
+        self.keys = list(index.keys)
+        self.page_words = list(index.page_words)
+        self.page_versions = list(pages.versions)
+        self.saved = index.saved
+        self.new_keys = None
+        self.file_name = None
+
+    def write(self, written, file_name):
+        # written holds the pages as they are in the saved file. Only pages
+        # indexed at their saved content get a key; the rest are indexed again
+        # next time.
+        keys = []
+        for page_num in range(len(self.versions)):
+            key = None
+            if page_num < len(written) and page_num < len(self.page_versions):
+                if self.versions[page_num] == self.page_versions[page_num]:
+                    key = page_key(written, page_num)
+                elif self.versions[page_num] is None and self.keys[page_num]:
+                    # Loaded from the sidecar and not refreshed since: still
+                    # good if the page went back to disk unchanged.
+                    key = page_key(written, page_num)
+                    if key != self.keys[page_num]:
+                        key = None
+            keys.append(key)
+
+        # Writing the word lists of a large document takes seconds, and most
+        # saves leave every entry as it was.
+        if self.saved != (file_name, keys) and (self.saved is not None or any(keys)):
+            temp_name = file_name + '.tmp'
+            with gzip.open(temp_name, 'wb', compresslevel=INDEX_COMPRESS_LEVEL) as file:
+                file.write(f'{{"format": {INDEX_FORMAT}, "pages": ['.encode('utf-8'))
+                for start in range(0, len(keys), INDEX_BLOCK_PAGES):
+                    entries = [
+                        {"key": key, "words": self.page_words[page_num] if key else {}}
+                        for page_num, key in enumerate(keys[start:start + INDEX_BLOCK_PAGES], start)
+                    ]
+                    block = json.dumps(entries)[1:-1]
+                    file.write(((', ' if start else '') + block).encode('utf-8'))
+                file.write(b']}')
+            os.replace(temp_name, file_name)
+        self.new_keys = keys
+        self.file_name = file_name
+
+    def finish(self):
+        # Entries the index changed since the copy was taken are left alone.
+        if self.new_keys is None:
+            return
+        index = self.index
+        for page_num, key in enumerate(self.new_keys):
+            if key is None or page_num >= len(index.versions):
+                continue
+            if index.versions[page_num] == self.versions[page_num] and index.keys[page_num] == self.keys[page_num]:
+                index.keys[page_num] = key
+                index.versions[page_num] = self.page_versions[page_num]
+        index.saved = (self.file_name, self.new_keys)
@@ -0,0 +1,52 @@
+import json
+
+from assets import config_path
+
+DEFAULTS = {
+    # Size of the process pool for whole-document commands, 0 means one worker per CPU.
+    "worker_count": 0,
+    # Documents with fewer pages than this are transformed in-process.
+    "parallel_min_pages": 64,
+    # Whole-document actions clicked within this many milliseconds are applied in one pass.
+    "document_batch_delay_ms": 400,
+    # Limits of the cache of parsed pages kept for page navigation.
+    "page_cache_pages": 10,
+    "page_cache_characters": 5000000,
+    # Models of edited pages kept to rebuild them on the next visit without parsing.
+    "page_model_cache_pages": 2048,
+    # Pages longer than this are edited as plain text in a view that only lays out the visible lines.
+    # They go back to rich text once their text is under half of it.
+    "large_page_characters": 2000000,
+    # Memory allowed for decoded embedded images shared by all pages.
+    "image_cache_bytes": 67108864,
+    # Seconds between automatic saves of a modified document that has a file, 0 turns them off.
+    "autosave_interval_s": 120,
+    # Memory for the compressed pages kept to undo whole-document commands.
+    "undo_history_bytes": 33554432,
+    # Chrome trace of command timings is written here, empty turns tracing off.
+    "trace_file": "",
+    # Size at which the trace file is moved to <trace_file>.1 and started again.
+    "trace_max_bytes": 16777216,
+    # Also save a cProfile of every traced command next to the trace file.
+    "profile_commands": False,
+}
+
+
+class Settings:
+    def __init__(self, filepath=config_path('settings.json')):
+        self.filepath = filepath
+        self.values = dict(DEFAULTS)
+        self.values.update(self.load_settings())
+
+    def load_settings(self):
+        try:
+            with open(self.filepath, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key):
+        return self.values.get(key, DEFAULTS.get(key))
+
+
+settings = Settings()
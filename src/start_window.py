@@ -1,7 +1,8 @@
 from PySide6.QtCore import Qt, QSize
-from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QWidget, QHBoxLayout, QToolButton
 
+from assets import icon
+
 
 class StartWindow(QWidget):
     def __init__(self):
@@ -9,14 +10,14 @@ class StartWindow(QWidget):
         button_layout = QHBoxLayout()
 
         self.new_file_button = QToolButton()
-        self.new_file_button.setIcon(QIcon('../resources/new.png'))
+        self.new_file_button.setIcon(icon('new.png'))
         self.new_file_button.setIconSize(QSize(64, 64))
         self.new_file_button.setText('New')
         self.new_file_button.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
         self.new_file_button.setToolTip('New file')
 
         self.open_file_button = QToolButton()
-        self.open_file_button.setIcon(QIcon('../resources/open.png'))
+        self.open_file_button.setIcon(icon('open.png'))
         self.open_file_button.setIconSize(QSize(64, 64))
         self.open_file_button.setText('Open')
         self.open_file_button.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
@@ -0,0 +1,65 @@
+import json
+import sys
+import time
+
+from PySide6.QtCore import QEvent, QObject, QTimer
+
+# Milestones from the start of main.py to the first paint of the start window
+# and of an empty editor, printed in the layout of python -X importtime when
+# the editor is started with --startup-report[=file.json].
+
+REPORT_OPTION = '--startup-report'
+
+
+def report_path(argv):
+    # None without the option, '' for printing only, or the JSON file to write.
+    for arg in argv:
+        if arg == REPORT_OPTION:
+            return ''
+        if arg.startswith(REPORT_OPTION + '='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+class StartupReport(QObject):
+    def __init__(self, started, path=''):
+        super().__init__()
+        self.started = started
+        self.path = path
+        self.marks = []
+        self.painted = None
+
+    def mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+
+    def on_first_paint(self, widget, callback):
+        self.painted = (widget, callback)
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if self.painted is not None and watched is self.painted[0] and event.type() == QEvent.Paint:
+            widget, callback = self.painted
+            self.painted = None
+            widget.removeEventFilter(self)
+            # Let the paint finish before taking the next step.
+            QTimer.singleShot(0, callback)
+        return False
+
+    def phases(self):
+        previous = self.started
+        phases = []
+        for name, moment in self.marks:
+            phases.append({"phase": name, "ms": (moment - previous) * 1000, "total_ms": (moment - self.started) * 1000})
+            previous = moment
+        return phases
+
+    def write(self):
+        phases = self.phases()
+        print("startup: self [ms] | cumulative [ms] | phase", file=sys.stderr)
+        for phase in phases:
+            print(f"startup: {phase['ms']:9.1f} | {phase['total_ms']:15.1f} | {phase['phase']}", file=sys.stderr)
+        deferred = [name for name in ('bs4',) if name not in sys.modules]
+        print(f"startup: not imported yet: {', '.join(deferred) or 'none'}", file=sys.stderr)
+        if self.path:
+            with open(self.path, 'w') as file:
+                json.dump({"phases": phases, "deferred_modules": deferred}, file, indent=2)
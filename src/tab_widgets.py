@@ -1,8 +1,9 @@
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QAction, QIcon
+from PySide6.QtGui import QAction
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QToolBar, QFontComboBox, QComboBox, QToolButton, QMenu, QCheckBox, \
     QDialog, QColorDialog, QSizePolicy
 
+from assets import icon, resource_url
 from commands import *
 from custom_styles import StyleManager, StyleDialog
 from find_replace_dialog import FindReplaceDialog
@@ -26,14 +27,36 @@ def get_checkbox_stylesheet():
         }
 
         QCheckBox::indicator:checked {
-            image: url(../resources/check.png);
+            image: url(CHECK_ICON);
         }
 
         QCheckBox::indicator:unchecked {
             background-color: #f5f5f5;
         }
     """
-    return stylesheet
+    return stylesheet.replace('CHECK_ICON', resource_url('check.png'))
+
+
+class LazyTab(QWidget):
+    # Stands in for a tab until it is first shown, so icons and font lists of
+    # tabs nobody opens are never built.
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+        self.widget = None
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def ensure_built(self):
+        if self.widget is None:
+            self.widget = self.factory()
+            self.layout().addWidget(self.widget)
+        return self.widget
+
+    def showEvent(self, event):
+        self.ensure_built()
+        super().showEvent(event)
 
 
 class FileTab(QWidget):
@@ -53,19 +76,19 @@ class FileTab(QWidget):
         toolbar.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
 
         # New action
-        new_action = QAction(QIcon('../resources/new.png'), 'New', self)
+        new_action = QAction(icon('new.png'), 'New', self)
         new_action.triggered.connect(self.new_file_action)
         toolbar.addAction(new_action)
         toolbar.addSeparator()
 
         # Open action
-        open_action = QAction(QIcon('../resources/open.png'), 'Open', self)
+        open_action = QAction(icon('open.png'), 'Open', self)
         open_action.triggered.connect(self.open_file_action)
         toolbar.addAction(open_action)
         toolbar.addSeparator()
 
         # Save action
-        save_action = QAction(QIcon('../resources/save.png'), 'Save', self)
+        save_action = QAction(icon('save.png'), 'Save', self)
         save_action.triggered.connect(self.save_file_action)
         toolbar.addAction(save_action)
 
@@ -110,7 +133,7 @@ class MainTab(QWidget):
         self.add_font_size_selection(toolbar)
 
         # Text color action
-        color_action = QAction(QIcon('../resources/color.png'), "Color", self)
+        color_action = QAction(icon('color.png'), "Color", self)
         color_action.triggered.connect(self.change_text_color)
         toolbar.addAction(color_action)
 
@@ -135,18 +158,39 @@ class MainTab(QWidget):
         self.apply_to_whole_doc.setStyleSheet(get_checkbox_stylesheet())
         toolbar.addWidget(self.apply_to_whole_doc)
 
+        # Undo/Redo of whole-document changes
+        self.add_history_actions(toolbar)
+
         return toolbar
 
+    def add_history_actions(self, toolbar):
+        self.undo_document_action = QAction("Undo Doc", self)
+        self.undo_document_action.setToolTip("Undo the last change applied to the entire document")
+        self.undo_document_action.triggered.connect(self.editor_widget.undo_document_command)
+        toolbar.addAction(self.undo_document_action)
+
+        self.redo_document_action = QAction("Redo Doc", self)
+        self.redo_document_action.setToolTip("Redo the last undone change to the entire document")
+        self.redo_document_action.triggered.connect(self.editor_widget.redo_document_command)
+        toolbar.addAction(self.redo_document_action)
+
+        self.editor_widget.history_changed.connect(self.update_history_actions)
+        self.update_history_actions()
+
+    def update_history_actions(self):
+        self.undo_document_action.setEnabled(self.editor_widget.history.can_undo())
+        self.redo_document_action.setEnabled(self.editor_widget.history.can_redo())
+
     def add_formatting_actions(self, toolbar):
-        bold_action = QAction(QIcon('../resources/bold.png'), 'Bold', self)
+        bold_action = QAction(icon('bold.png'), 'Bold', self)
         bold_action.triggered.connect(self.toggle_bold)
         toolbar.addAction(bold_action)
 
-        italic_action = QAction(QIcon('../resources/italic.png'), 'Italic', self)
+        italic_action = QAction(icon('italic.png'), 'Italic', self)
         italic_action.triggered.connect(self.toggle_italic)
         toolbar.addAction(italic_action)
 
-        underline_action = QAction(QIcon('../resources/underline.png'), 'Underline', self)
+        underline_action = QAction(icon('underline.png'), 'Underline', self)
         underline_action.triggered.connect(self.toggle_underline)
         toolbar.addAction(underline_action)
 
@@ -158,7 +202,7 @@ class MainTab(QWidget):
         toolbar.addWidget(self.font_button)
 
         font_settings_button = QToolButton()
-        font_settings_button.setIcon(QIcon('../resources/settings.png'))
+        font_settings_button.setIcon(icon('settings.png'))
         font_settings_button.setToolTip('Select font')
         font_settings_button.clicked.connect(self.open_font_selection_dialog)
         toolbar.addWidget(font_settings_button)
@@ -170,17 +214,17 @@ class MainTab(QWidget):
         toolbar.addWidget(font_size_box)
 
     def add_indent_actions(self, toolbar):
-        outdent_action = QAction(QIcon('../resources/outdent.png'), 'Outdent', self)
+        outdent_action = QAction(icon('outdent.png'), 'Outdent', self)
         outdent_action.triggered.connect(self.decrease_indent)
         toolbar.addAction(outdent_action)
 
-        indent_action = QAction(QIcon('../resources/indent.png'), 'Indent', self)
+        indent_action = QAction(icon('indent.png'), 'Indent', self)
         indent_action.triggered.connect(self.increase_indent)
         toolbar.addAction(indent_action)
 
     def add_line_spacing_button(self, toolbar):
         line_spacing_button = QToolButton()
-        line_spacing_button.setIcon(QIcon('../resources/line_spacing.png'))
+        line_spacing_button.setIcon(icon('line_spacing.png'))
         line_spacing_button.setToolTip('Line spacing')
         line_spacing_menu = QMenu(self)
         for spacing in ['1.0', '1.15', '1.5', '2.0', '2.5', '3.0']:
@@ -191,27 +235,30 @@ class MainTab(QWidget):
         line_spacing_button.setPopupMode(QToolButton.InstantPopup)
         toolbar.addWidget(line_spacing_button)
 
+    def queue_document_command(self, command):
+        self.editor_widget.batch_document_command(command, DocumentPipeline)
+
     def toggle_bold(self):
         if self.apply_to_whole_doc.isChecked():
-            ToggleBoldDocumentCommand(self.editor_widget).execute()
+            self.queue_document_command(ToggleBoldDocumentCommand(self.editor_widget))
             return
         ToggleBoldCommand(self.editor_widget).execute()
 
     def toggle_italic(self):
         if self.apply_to_whole_doc.isChecked():
-            ToggleItalicDocumentCommand(self.editor_widget).execute()
+            self.queue_document_command(ToggleItalicDocumentCommand(self.editor_widget))
             return
         ToggleItalicCommand(self.editor_widget).execute()
 
     def toggle_underline(self):
         if self.apply_to_whole_doc.isChecked():
-            ToggleUnderlineDocumentCommand(self.editor_widget).execute()
+            self.queue_document_command(ToggleUnderlineDocumentCommand(self.editor_widget))
             return
         ToggleUnderlineCommand(self.editor_widget).execute()
 
     def set_font(self):
         if self.apply_to_whole_doc.isChecked():
-            SetFontDocumentCommand(self.editor_widget, QFont(self.font_button.text())).execute()
+            self.queue_document_command(SetFontDocumentCommand(self.editor_widget, QFont(self.font_button.text())))
             return
         SetFontCommand(self.editor_widget, QFont(self.font_button.text())).execute()
 
@@ -236,7 +283,7 @@ class MainTab(QWidget):
 
     def set_font_size(self, size):
         if self.apply_to_whole_doc.isChecked():
-            SetFontSizeDocumentCommand(self.editor_widget, int(size)).execute()
+            self.queue_document_command(SetFontSizeDocumentCommand(self.editor_widget, int(size)))
             return
         SetFontSizeCommand(self.editor_widget, int(size)).execute()
 
@@ -244,13 +291,15 @@ class MainTab(QWidget):
         color = QColorDialog.getColor()
         if color.isValid():
             if self.apply_to_whole_doc.isChecked():
-                SetFontColorDocumentCommand(self.editor_widget, color).execute()
+                self.queue_document_command(SetFontColorDocumentCommand(self.editor_widget, color))
                 return
             SetFontColorCommand(self.editor_widget, color).execute()
 
     def increase_indent(self):
         if self.apply_to_whole_doc.isChecked():
-            IncreaseIndentDocumentCommand(self.editor_widget).execute()
+            self.queue_document_command(IncreaseIndentDocumentCommand(self.editor_widget))
+            return
+        if self.editor_widget.refuse_rich_edit():
             return
         cursor = self.editor_widget.text_edit.textCursor()
         block_format = cursor.blockFormat()
@@ -259,7 +308,9 @@ class MainTab(QWidget):
 
     def decrease_indent(self):
         if self.apply_to_whole_doc.isChecked():
-            DecreaseIndentDocumentCommand(self.editor_widget).execute()
+            self.queue_document_command(DecreaseIndentDocumentCommand(self.editor_widget))
+            return
+        if self.editor_widget.refuse_rich_edit():
             return
         cursor = self.editor_widget.text_edit.textCursor()
         block_format = cursor.blockFormat()
@@ -276,7 +327,7 @@ class MainTab(QWidget):
 
     def set_line_spacing(self, spacing):
         if self.apply_to_whole_doc.isChecked():
-            SetLineSpacingDocumentCommand(self.editor_widget, float(spacing)).execute()
+            self.queue_document_command(SetLineSpacingDocumentCommand(self.editor_widget, float(spacing)))
             return
         SetLineSpacingCommand(self.editor_widget, float(spacing)).execute()
 
@@ -297,12 +348,12 @@ class InsertTab(QWidget):
         toolbar = QToolBar()
         toolbar.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
 
-        insert_image_action = QAction(QIcon('../resources/insert_image.png'), 'Insert Image', self)
+        insert_image_action = QAction(icon('insert_image.png'), 'Insert Image', self)
         insert_image_action.triggered.connect(self.insert_image)
         toolbar.addAction(insert_image_action)
         toolbar.addSeparator()
 
-        insert_link_action = QAction(QIcon('../resources/insert_link.png'), 'Insert Link', self)
+        insert_link_action = QAction(icon('insert_link.png'), 'Insert Link', self)
         insert_link_action.setToolTip('Insert Link (Ctrl + Left Click to follow)')
         insert_link_action.triggered.connect(self.insert_link)
         toolbar.addAction(insert_link_action)
@@ -334,13 +385,13 @@ class StylesTab(QWidget):
         toolbar.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
 
         style_name = str(next(iter(self.style_manager.styles), None))
-        self.style_button = QAction(QIcon('../resources/style.png'), style_name, self)
+        self.style_button = QAction(icon('style.png'), style_name, self)
         self.style_button.setToolTip('Your Style')
         self.style_button.triggered.connect(self.apply_selected_style)
         toolbar.addAction(self.style_button)
 
         style_settings_button = QToolButton()
-        style_settings_button.setIcon(QIcon('../resources/settings.png'))
+        style_settings_button.setIcon(icon('settings.png'))
         style_settings_button.setToolTip('Manage Style')
         style_settings_button.clicked.connect(self.open_style_settings_dialog)
         toolbar.addWidget(style_settings_button)
@@ -363,7 +414,6 @@ class StylesTab(QWidget):
             ApplyStyleDocumentCommand(self.editor_widget, self.style_button.text(), self.style_manager).execute()
             return
         ApplyStyleCommand(self.editor_widget, self.style_button.text(), self.style_manager).execute()
-        ApplyStyleCommand(self.editor_widget, self.style_button.text(), self.style_manager).execute()
 
     def open_style_settings_dialog(self):
         dialog = StyleDialog(self.style_manager, self)
@@ -391,7 +441,7 @@ class FindReplaceTab(QWidget):
         toolbar = QToolBar()
         toolbar.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
 
-        self.style_button = QAction(QIcon('../resources/find_and_replace.png'), "Find and Replace", self)
+        self.style_button = QAction(icon('find_and_replace.png'), "Find and Replace", self)
         self.style_button.triggered.connect(self.open_search_dialog)
         toolbar.addAction(self.style_button)
 
@@ -1,10 +1,10 @@
-from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QMainWindow, QStackedWidget, QTabWidget
 
-from commands import *
+from assets import icon
+from commands import OpenFileCommand
 from editor_widget import EditorWidget
 from start_window import StartWindow
-from tab_widgets import FileTab, MainTab, InsertTab, StylesTab, FindReplaceTab
+from tab_widgets import FileTab, MainTab, InsertTab, StylesTab, FindReplaceTab, LazyTab
 
 
 class TextProcessor(QMainWindow):
@@ -20,10 +20,17 @@ class TextProcessor(QMainWindow):
         self.setCentralWidget(self.stacked_widget)
 
         self.start_window.connect_signals(self.create_new_file, self.open_existing_file)
+        self.editor_widget.modification_changed.connect(self.setWindowModified)
+        self.editor_widget.status_changed.connect(self.statusBar().showMessage)
 
         self.adjust_size_for_start_window()
-        self.setWindowTitle('Text Processor')
-        self.setWindowIcon(QIcon('../resources/logo.png'))
+        self.setWindowTitle('Text Processor[*]')
+        self.setWindowIcon(icon('logo.png'))
+
+    def closeEvent(self, event):
+        # A save still running in the background has to reach the file first.
+        self.editor_widget.wait_for_save()
+        super().closeEvent(event)
 
     def create_new_file(self) -> None:
         self.stacked_widget.setCurrentWidget(self.editor_widget)
@@ -46,11 +53,11 @@ class TextProcessor(QMainWindow):
         self.tab_widget.setMaximumHeight(100)
         self.editor_widget.layout.addWidget(self.tab_widget, 0, 0, 1, 3)
 
-        file_tab = FileTab(self.editor_widget)
-        main_tab = MainTab(self.editor_widget)
-        insert_tab = InsertTab(self.editor_widget)
-        styles_tab = StylesTab(self.editor_widget)
-        replace_search_tab = FindReplaceTab(self.editor_widget)
+        file_tab = LazyTab(lambda: FileTab(self.editor_widget))
+        main_tab = LazyTab(lambda: MainTab(self.editor_widget))
+        insert_tab = LazyTab(lambda: InsertTab(self.editor_widget))
+        styles_tab = LazyTab(lambda: StylesTab(self.editor_widget))
+        replace_search_tab = LazyTab(lambda: FindReplaceTab(self.editor_widget))
 
         self.tab_widget.addTab(file_tab, "File")
         self.tab_widget.addTab(main_tab, "Home")
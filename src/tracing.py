@@ -0,0 +1,213 @@
+import atexit
+import cProfile
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+from settings import settings
+
+# Timings of commands and page work as Chrome trace events, for
+# chrome://tracing or ui.perfetto.dev, written to the file named by the
+# trace_file setting. With tracing off a span is one attribute check.
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    # A complete ('X') event. Spans that collect phases add up the time spent
+    # in tracer.phase blocks on their thread and report it in their args.
+    __slots__ = ('tracer', 'name', 'category', 'args', 'phases', 'outer_phases', 'start')
+
+    def __init__(self, tracer, name, category, args, collect_phases):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.phases = {} if collect_phases else None
+        self.outer_phases = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        if self.phases is not None:
+            self.outer_phases = getattr(self.tracer.local, 'phases', None)
+            self.tracer.local.phases = self.phases
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+        if self.phases is not None:
+            self.tracer.local.phases = self.outer_phases
+            for name, elapsed in self.phases.items():
+                self.args[name + '_ms'] = round(elapsed / 1e6, 3)
+        if exc_info[0] is not None:
+            self.args['error'] = exc_info[0].__name__
+        self.tracer.complete(self.name, self.category, self.start, duration, self.args)
+        return False
+
+
+class Phase:
+    __slots__ = ('phases', 'name', 'start')
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.phases[self.name] = self.phases.get(self.name, 0) + time.perf_counter_ns() - self.start
+        return False
+
+
+class Profile:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Already profiled further up this thread.
+            return self
+        self.profiler = profiler
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.tracer.profile_file_name(self.name))
+        return False
+
+
+class Tracer:
+    def __init__(self, file_name=None, max_bytes=None, profile_commands=None):
+        self.file_name = settings.get("trace_file") if file_name is None else file_name
+        self.max_bytes = settings.get("trace_max_bytes") if max_bytes is None else max_bytes
+        self.profile_commands = settings.get("profile_commands") if profile_commands is None else profile_commands
+        # Worker processes leave the file to the editor.
+        self.enabled = bool(self.file_name) and multiprocessing.parent_process() is None
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.file = None
+        self.first_event = True
+        self.named_threads = set()
+        self.profile_numbers = itertools.count(1)
+        if self.enabled:
+            atexit.register(self.close)
+            os.register_at_fork(before=self.flush, after_in_child=self.disable)
+
+    def span(self, name, category, collect_phases=False, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args, collect_phases)
+
+    def phase(self, name):
+        phases = getattr(self.local, 'phases', None) if self.enabled else None
+        if phases is None:
+            return NULL_SPAN
+        return Phase(phases, name)
+
+    def profile(self, name):
+        if not (self.enabled and self.profile_commands):
+            return NULL_SPAN
+        return Profile(self, name)
+
+    def profile_file_name(self, name):
+        return f"{self.file_name}.{name}.{next(self.profile_numbers)}.prof"
+
+    def complete(self, name, category, start_ns, duration_ns, args):
+        self.write({
+            "name": name, "cat": category, "ph": "X", "ts": start_ns / 1000, "dur": duration_ns / 1000,
+            "pid": self.pid, "tid": threading.get_ident(), "args": args,
+        })
+
+    def write(self, event):
+        thread = threading.current_thread()
+        with self.lock:
+            if self.file is None:
+                self.open()
+            elif self.file.tell() > self.max_bytes:
+                self.rotate()
+            if thread.ident not in self.named_threads:
+                self.named_threads.add(thread.ident)
+                self.write_event({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                    "args": {"name": thread.name},
+                })
+            self.write_event(event)
+
+    def write_event(self, event):
+        self.file.write(('[\n' if self.first_event else ',\n') + json.dumps(event, separators=(',', ':')))
+        self.first_event = False
+
+    def open(self):
+        self.file = open(self.file_name, 'w', encoding='utf-8')
+        self.first_event = True
+        self.named_threads = set()
+
+    def rotate(self):
+        # The previous file is kept beside the current one, so a long session
+        # takes at most twice trace_max_bytes.
+        self.finish_file()
+        os.replace(self.file_name, self.file_name + '.1')
+        self.open()
+
+    def finish_file(self):
+        self.file.write('[]\n' if self.first_event else '\n]\n')
+        self.file.close()
+        self.file = None
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.finish_file()
+
+    def disable(self):
+        # The child of a fork must not close or write the parent's file.
+        self.enabled = False
+        self.file = None
+        self.lock = threading.Lock()
+
+
+tracer = Tracer()
+
+
+def traced_command(execute):
+    @functools.wraps(execute)
+    def wrapper(self, *args, **kwargs):
+        if not tracer.enabled:
+            return execute(self, *args, **kwargs)
+        name = type(self).__name__
+        with tracer.span(name, 'command'), tracer.profile(name):
+            return execute(self, *args, **kwargs)
+    return wrapper